@@ -8,13 +8,22 @@ import time
 import subprocess
 import os
 import json
+import math
 import yaml
 from sys import platform
 from PIL import Image, ImageTk
-from camera_setup import create_devices_with_tries, Camera_On, Camera_off
-from arena_api.system import system
+from camera_setup import create_devices_with_tries, Camera_On, Camera_off, system
+from camera_watchdog import Camera_Watchdog
+from fake_device import create_fake_devices
+from recorder import Recording_Session
+from stream_replay import create_replay_devices
+from frame_bus import Frame_Bus_Publisher
+from shard_capture import Shard_Coordinator
+import frame_trace
+from scene_change import Scene_Change_Detector
 import time
 from utils import *
+from undistort import crop_undistort_maps, preprocess_frame
 
 # Load calibration data
 mapx = mapy = None
@@ -24,16 +33,76 @@ mtx = np.array(calibration_data["camera_matrix"])
 dist = np.array(calibration_data["distortion_coefficients"])
 w = calibration_data["image_width"]
 h = calibration_data["image_height"]
+sensor_width, sensor_height = w, h
 newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
 mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, (w, h), 5)
 x, y, w, h = roi
 
+# Undistortion maps per camera acquisition geometry, see get_undistort_maps
+undistort_maps = {}
+
 
 save_directory_path, Set_exposure, MAC_list, border_size = None, None, None, None
+stream_stats_config, watchdog_config, simulate_devices, recording_config = None, None, False, None
+replay_config, frame_bus_config, sharding_config, tracing_config = None, None, None, None
+scene_change_config = None
+# Size of one undistorted image in the grid and the preview scale of the grid
+acquisition, cell_w, cell_h, view_scale = None, w, h, 0.2
+
+
+def undistort_sensor_roi():
+    # Bounding box on the sensor of the pixels the undistorted crop is interpolated from
+    roi_mapx = mapx[y : y + h, x : x + w]
+    roi_mapy = mapy[y : y + h, x : x + w]
+    offset_x = min(max(int(np.floor(roi_mapx.min())), 0), sensor_width - 1)
+    offset_y = min(max(int(np.floor(roi_mapy.min())), 0), sensor_height - 1)
+    end_x = min(max(int(np.ceil(roi_mapx.max())) + 2, offset_x + 1), sensor_width)
+    end_y = min(max(int(np.ceil(roi_mapy.max())) + 2, offset_y + 1), sensor_height)
+    return (offset_x, offset_y, end_x - offset_x, end_y - offset_y)
+
+
+def setup_acquisition_geometry(acquisition_config):
+    # Sensor ROI and binning requested from the cameras, and the grid geometry that follows from them
+    global acquisition, cell_w, cell_h, view_scale
+    binning = int(acquisition_config.get("binning", 1))
+    binning_mode = acquisition_config.get("binning_mode", "binning")
+    assert binning >= 1, "binning must be at least 1"
+    assert binning_mode in ("binning", "decimation"), f"Unknown binning_mode {binning_mode}"
+
+    acquisition = {
+        "sensor_roi": undistort_sensor_roi() if acquisition_config.get("sensor_roi", False) else None,
+        "binning": binning,
+        "binning_mode": binning_mode,
+    }
+    cell_w, cell_h = w // binning, h // binning
+    # Keep the preview the same size on screen
+    view_scale = 0.2 * binning
+    undistort_maps.clear()
+
+
+def get_undistort_maps(acquisition_geometry):
+    # Cached per camera geometry, see crop_undistort_maps
+    if acquisition_geometry not in undistort_maps:
+        undistort_maps[acquisition_geometry] = crop_undistort_maps(mapx, mapy, roi, acquisition_geometry)
+    return undistort_maps[acquisition_geometry]
+
+
+def grid_shape():
+    # Rows and columns of the preview grid, as square as possible for the cameras of MAC_list
+    cols = math.ceil(math.sqrt(len(MAC_list)))
+    rows = math.ceil(len(MAC_list) / cols)
+    return rows, cols
+
+
+def empty_grid():
+    rows, cols = grid_shape()
+    return np.zeros((rows * (cell_h + 2 * border_size), cols * (cell_w + 2 * border_size), 3), dtype=np.uint8)
 
 
 def load_config(config_file_path="config.yaml"):
-    global save_directory_path, Set_exposure, MAC_list, border_size
+    global save_directory_path, Set_exposure, MAC_list, border_size, stream_stats_config, watchdog_config
+    global simulate_devices, recording_config, replay_config, frame_bus_config, sharding_config, tracing_config
+    global scene_change_config
     # Load configuration from YAML file
     with open(config_file_path, "r") as yaml_file:
         config = yaml.safe_load(yaml_file)
@@ -43,6 +112,16 @@ def load_config(config_file_path="config.yaml"):
     Set_exposure = config["Set_exposure"]
     MAC_list = config["MAC_list"]
     border_size = config.get("border_size", 10)  # Default value of 10
+    stream_stats_config = config.get("stream_stats") or {}
+    watchdog_config = config.get("watchdog") or {}
+    simulate_devices = config.get("simulate_devices", False)
+    recording_config = config.get("recording") or {}
+    replay_config = config.get("replay")
+    frame_bus_config = config.get("frame_bus") or {}
+    sharding_config = config.get("sharding") or {}
+    tracing_config = config.get("tracing") or {}
+    scene_change_config = config.get("scene_change") or {}
+    setup_acquisition_geometry(config.get("acquisition") or {})
 
 
 load_config("config.yaml")
@@ -54,23 +133,6 @@ def safe_print(*args, **kwargs):
         print(*args, **kwargs)
 
 
-# Function to convert an integer to a MAC address string
-def int_to_mac(mac_value):
-    try:
-        mac_bytes = [
-            (mac_value >> 40) & 0xFF,
-            (mac_value >> 32) & 0xFF,
-            (mac_value >> 24) & 0xFF,
-            (mac_value >> 16) & 0xFF,
-            (mac_value >> 8) & 0xFF,
-            mac_value & 0xFF,
-        ]
-        mac_address = ":".join(f"{byte:02X}" for byte in mac_bytes)
-        return mac_address
-    except Exception as e:
-        return f"Error converting MAC address: {e}"
-
-
 class ImageSaverApp:
 
     def __init__(self, root, save_directory_path, Set_exposure):
@@ -80,6 +142,13 @@ class ImageSaverApp:
         self.save_directory_path = save_directory_path
         self.Set_exposure = Set_exposure
         self.image_buffer = None
+        self.init_scene_detector()
+        self.watchdog = None
+        self.recording = None
+        self.frame_bus = None
+        self.coordinator = None
+        if tracing_config.get("enabled", False):
+            frame_trace.enable_tracing(tracing_config.get("max_events", 1000000))
         self.camera_init()
 
         # Initialize custom naming pattern variables
@@ -178,8 +247,16 @@ class ImageSaverApp:
         )
         self.clear_comment_button.grid(row=6, column=1, columnspan=2, padx=(0, 10), pady=0, sticky="ew")
 
-        combined_images = np.zeros((2 * (h + 2 * border_size), 2 * (w + 2 * border_size), 3), dtype=np.uint8)
-        view_image = cv2.resize(combined_images, (0, 0), fx=0.2, fy=0.2)
+        self.record_button = tk.Button(root, text="Record", command=self.toggle_recording, height=2, width=16)
+        self.record_button.grid(row=7, column=3, columnspan=2, padx=(0, 10), pady=0, sticky="ew")
+
+        # Stream health warnings of all cameras
+        self.health_label = tk.Label(root, text="", anchor="w", justify="left", fg="red", wraplength=300)
+        self.health_label.grid(row=6, column=3, columnspan=2, padx=(0, 10), pady=0, sticky="ew")
+        self.health_warnings = []
+        self.last_health_poll = 0.0
+
+        view_image = cv2.resize(empty_grid(), (0, 0), fx=view_scale, fy=view_scale)
         self.update_image_grid(view_image)
 
         self.osk_process = None
@@ -217,8 +294,16 @@ class ImageSaverApp:
     def camera_init(self):
         # Initialize the cameras, their thread events, and main app thread condition
         start_time = time.time()
+        if sharding_config.get("shards", 1) > 1:
+            self.shard_init()
+            return
         self.frame_list = [None] * len(MAC_list)
-        devices = create_devices_with_tries()
+        if replay_config:
+            devices = create_replay_devices(**replay_config)
+        elif simulate_devices:
+            devices = create_fake_devices(MAC_list)
+        else:
+            devices = create_devices_with_tries()
 
         # Initialize the cameras in MAC_list order
         for i in range(len(devices)):
@@ -227,7 +312,13 @@ class ImageSaverApp:
             index = MAC_list.index(mac_address)
 
             # Populate frame_list and threading_event_list
-            self.frame_list[index] = Camera_On(self.Set_exposure, index, devices[i])
+            self.frame_list[index] = Camera_On(
+                self.Set_exposure, index, devices[i], stream_stats_config, acquisition
+            )
+            assert self.frame_list[index].acquisition_geometry[4] == acquisition["binning"], (
+                f"Camera_{index} uses binning {self.frame_list[index].acquisition_geometry[4]}, "
+                f"config.yaml asks for {acquisition['binning']}"
+            )
 
         # Wait for all cameras to negotiate PTP Sync
         i = 0
@@ -267,6 +358,33 @@ class ImageSaverApp:
         end_time = time.time()
         print(f"All cameras initialization took {end_time - start_time} seconds.")
 
+    def shard_init(self):
+        # Run the cameras in worker processes, their preprocessed frames arrive over shared memory
+        start_time = time.time()
+        assert not replay_config, "Replay is not supported with sharded capture"
+        settings = {
+            "Set_exposure": self.Set_exposure,
+            "acquisition": acquisition,
+            "mapx": mapx,
+            "mapy": mapy,
+            "roi": roi,
+            "simulate_devices": simulate_devices,
+            "bus_name": frame_bus_config.get("name", "ag_cameras"),
+            "slots": frame_bus_config.get("slots", 4),
+            "stream_stats_config": stream_stats_config,
+            "watchdog_config": watchdog_config,
+            "scene_change_config": scene_change_config,
+        }
+        self.coordinator = Shard_Coordinator(MAC_list, sharding_config["shards"], settings)
+        self.coordinator.wait_for_ptp()
+        self.frame_list = self.coordinator.frame_list
+
+        for which_camera, ptp_status in sorted(self.coordinator.ptp_status.items()):
+            print(f"Creating camera_{which_camera} (Status: {ptp_status})")
+
+        end_time = time.time()
+        print(f"All cameras initialization took {end_time - start_time} seconds.")
+
     # Function to handle button click event style and return the original text and color
     def button_click(self, button, display_text, bg_color="red"):
         original_text = button.cget("text")
@@ -294,11 +412,9 @@ class ImageSaverApp:
         # Change button style to show that the process has started
         original_text, original_color = self.button_click(self.button3, display_text="Starting...")
 
-        # For each frame, start the process in a separate thread
-        for frame in self.frame_list:
-            frame.startProcess()
+        self.start_cameras()
 
-        self.view_save_thread = threading.Thread(target=self.view_save_loop, args=())
+        self.view_save_thread = threading.Thread(target=self.view_save_loop, args=(), name="view_save")
         self.view_save_thread.daemon = True
         self.view_save_thread.start()
 
@@ -307,8 +423,7 @@ class ImageSaverApp:
 
     def reload_config(self):
         start_time = time.time()
-        combined_images = np.zeros((2 * (h + 2 * border_size), 2 * (w + 2 * border_size), 3), dtype=np.uint8)
-        view_image = cv2.resize(combined_images, (0, 0), fx=0.2, fy=0.2)
+        view_image = cv2.resize(empty_grid(), (0, 0), fx=view_scale, fy=view_scale)
         self.update_image_grid(view_image)
 
         original_text, original_color = self.button_click(self.button3, display_text="Reloading Config...")
@@ -325,6 +440,7 @@ class ImageSaverApp:
         input_exposure = float(input_exposure)
 
         load_config()
+        self.init_scene_detector()
         self.save_directory_path = save_directory_path
         if input_exposure != self.Set_exposure:
             self.Set_exposure = input_exposure
@@ -333,25 +449,145 @@ class ImageSaverApp:
 
         self.camera_init()
 
-        for frame in self.frame_list:
-            frame.startProcess()
+        self.start_cameras()
 
         self.root.after(2000, lambda: self.revert_button(self.button3, original_text, original_color))
 
         end_time = time.time()
         print(f"Reloading config took {end_time - start_time} seconds.")
 
+    def start_cameras(self):
+        if self.coordinator is not None:
+            # Each shard starts its cameras and runs its own watchdog
+            self.coordinator.start()
+            return
+
+        # For each frame, start the process in a separate thread
+        for frame in self.frame_list:
+            frame.startProcess()
+        self.start_watchdog()
+        self.start_frame_bus()
+
+    def start_watchdog(self):
+        # Restarts the stream of a single failed camera while the others keep streaming
+        self.watchdog = Camera_Watchdog(self.frame_list, **watchdog_config)
+        self.watchdog.start()
+
+    def stop_watchdog(self):
+        if self.watchdog is None:
+            return
+        self.watchdog.stop()
+        for which_camera, report in self.watchdog.report().items():
+            print(
+                f"Camera_{which_camera} restarts: {report['restarts']}, recoveries: {report['recoveries']}, "
+                f"downtime: {report['downtime']:.1f} seconds."
+            )
+        self.watchdog = None
+
+    def start_frame_bus(self):
+        # Optional shared memory publisher of the latest frames for other processes
+        if not frame_bus_config.get("enabled", False):
+            return
+        self.frame_bus = Frame_Bus_Publisher(
+            self.frame_list, name=frame_bus_config.get("name", "ag_cameras"), slots=frame_bus_config.get("slots", 4)
+        )
+
+    def stop_frame_bus(self):
+        if self.frame_bus is None:
+            return
+        self.frame_bus.close()
+        self.frame_bus = None
+
+    def toggle_recording(self):
+        if self.coordinator is not None:
+            self.show_popup("Recording is not available with sharded capture.")
+            return
+        if self.recording is None:
+            if not any(frame.working_properly for frame in self.frame_list):
+                self.show_popup("Start the cameras before recording.")
+                return
+            self.recording = Recording_Session(self.frame_list, **recording_config)
+            self.record_button.config(text="Stop Recording", bg="red")
+        else:
+            self.stop_recording()
+
+    def stop_recording(self):
+        if self.recording is None:
+            return
+        recording, self.recording = self.recording, None
+        stats = recording.stop()
+        self.record_button.config(text="Record", bg=self.button1.cget("bg"))
+
+        frames_written = sum(stat["frames_written"] for stat in stats.values())
+        frames_dropped = sum(stat["frames_dropped"] for stat in stats.values())
+        max_lag = max(stat["max_lag"] for stat in stats.values())
+        self.show_popup(
+            f"Recorded {frames_written} frames to {recording.directory} "
+            f"(dropped {frames_dropped}, max encoder lag {max_lag:.2f} s)"
+        )
+
+    def init_scene_detector(self):
+        # Last bordered cell of every camera in the grid and its (frame_id, timestamp_ns), and the last grid
+        self.grid_cells = {}
+        self.grid_frames = {}
+        self.combined_images = None
+        self.scene_detector = None
+        if scene_change_config.get("enabled", False):
+            self.scene_detector = Scene_Change_Detector(
+                threshold=scene_change_config.get("threshold", 0.5),
+                refresh_interval=scene_change_config.get("refresh_interval", 5.0),
+            )
+
     def view_save_loop(self):
         while True:
             start_time = time.time()
             buffer_list = []
-            for index, frame in enumerate(self.frame_list):
-                img_array = frame.read()
-                buffer_list.append(img_array)
-            self.view_image(buffer_list)
+            with frame_trace.span("read"):
+                for index, frame in enumerate(self.frame_list):
+                    img_array = frame.read()
+                    buffer_list.append(img_array)
+            refreshed = self.view_image(buffer_list)
+            self.check_stream_health()
+            if not refreshed:
+                # Nothing changed, do not spin on the same frames
+                time.sleep(scene_change_config.get("idle_sleep", 0.02))
+                continue
             end_time = time.time()
             print(f"New Frame update took {end_time - start_time} seconds.")
 
+    def stream_health(self):
+        # Rolling stream statistics of every camera, in MAC_list order
+        coordinator = self.coordinator
+        if coordinator is not None:
+            summaries = coordinator.stream_stats()
+            return [summaries.get(frame.which_camera) for frame in self.frame_list]
+        return [frame.stream_stats.summary() for frame in self.frame_list]
+
+    def check_stream_health(self):
+        warnings = []
+        coordinator = self.coordinator
+        if coordinator is not None:
+            # Every poll is a round trip to each shard worker
+            if time.time() - self.last_health_poll < 1.0:
+                return
+            self.last_health_poll = time.time()
+            try:
+                for _, camera_warnings in sorted(coordinator.health().items()):
+                    warnings.extend(camera_warnings)
+            except Exception as e:
+                warnings.append(f"Shard health poll failed: {e}")
+        else:
+            for frame in self.frame_list:
+                warnings.extend(frame.stream_stats.warnings())
+
+        # Only log and redraw when the set of warnings changes
+        if warnings == self.health_warnings:
+            return
+        self.health_warnings = warnings
+        for warning in warnings:
+            safe_print(f"Stream health warning: {warning}")
+        self.root.after(0, lambda: self.health_label.config(text="\n".join(warnings)))
+
     def update_image_grid(self, view_image):
         # Convert to PIL image and then to PhotoImage
         photo_img = Image.fromarray(cv2.cvtColor(view_image, cv2.COLOR_BGR2RGB))
@@ -360,46 +596,77 @@ class ImageSaverApp:
         self.img_label.image = photo_img
 
     def view_image(self, image_array_list):
-        buffer_bytes_per_pixel = 3
-        # Create a 2x2 grid to display the images, including space for the borders
-        combined_images = np.zeros(
-            (2 * (h + 2 * border_size), 2 * (w + 2 * border_size), buffer_bytes_per_pixel), dtype=np.uint8
-        )
+        # Returns False if no camera changed, then nothing is processed, composed or redrawn
+        # A grid recording needs every frame set composed
+        force_refresh = self.scene_detector is None or (self.recording is not None and self.recording.mode == "grid")
 
+        refreshed = False
         for _, image_array in enumerate(image_array_list):
             if image_array is not None:
-                (npndarray, i) = image_array
-                # Preprocess: lighting adjustment, undistortion, and cropping
-                npndarray = cv2.convertScaleAbs(npndarray, alpha=10, beta=60)
-                dst = cv2.remap(npndarray, mapx, mapy, cv2.INTER_LINEAR)
-                dst = dst[y : y + h, x : x + w]
-                cv2.imwrite(f"stitch/image_{i}_{self.count}.jpg", dst)
-
-                # Add white border to the image
-                dst_with_border = cv2.copyMakeBorder(
-                    dst,
-                    border_size,
-                    border_size,
-                    border_size,
-                    border_size,
-                    cv2.BORDER_CONSTANT,
-                    value=[255, 255, 255],
-                )
-
-                # Put the image in the right place in the 2x2 grid
-                row, col = divmod(i, 2)
+                (npndarray, i, frame_id, timestamp_ns) = image_array
+                # Skip cameras whose scene did not change since their last refresh. Shards only publish
+                # changed frames (judged before preprocessing), so any new frame from them counts as changed
+                frame = self.frame_list[i]
+                prefiltered = getattr(frame, "preprocessed", False)
+                if not force_refresh and not self.scene_detector.changed(i, npndarray, prefiltered=prefiltered):
+                    continue
+                refreshed = True
+
+                # Preprocess: lighting adjustment, undistortion, and cropping (done by the worker when sharded)
+                with frame_trace.span("process", camera=i, frame_id=frame_id):
+                    if getattr(frame, "preprocessed", False):
+                        dst = npndarray
+                    else:
+                        dst = preprocess_frame(npndarray, *get_undistort_maps(frame.acquisition_geometry))
+                with frame_trace.span("stitch_dump", camera=i, frame_id=frame_id):
+                    cv2.imwrite(f"stitch/image_{i}_{self.count}.jpg", dst)
+
+                with frame_trace.span("compose", camera=i, frame_id=frame_id):
+                    # Add white border to the image
+                    self.grid_cells[i] = cv2.copyMakeBorder(
+                        dst,
+                        border_size,
+                        border_size,
+                        border_size,
+                        border_size,
+                        cv2.BORDER_CONSTANT,
+                        value=[255, 255, 255],
+                    )
+                self.grid_frames[i] = (frame_id, timestamp_ns)
+
+        if not refreshed:
+            # Keep the last grid available for saving
+            if self.image_buffer is None:
+                self.image_buffer = self.combined_images
+            return False
+
+        with frame_trace.span("compose"):
+            # Create a grid with a cell per camera to display the images, including space for the borders
+            combined_images = empty_grid()
+            _, cols = grid_shape()
+
+            # Put the images in the right place in the grid, unchanged cameras keep their last image
+            for i, dst_with_border in self.grid_cells.items():
+                row, col = divmod(i, cols)
                 combined_images[
-                    row * (h + 2 * border_size) : (row + 1) * (h + 2 * border_size),
-                    col * (w + 2 * border_size) : (col + 1) * (w + 2 * border_size),
+                    row * (cell_h + 2 * border_size) : (row + 1) * (cell_h + 2 * border_size),
+                    col * (cell_w + 2 * border_size) : (col + 1) * (cell_w + 2 * border_size),
                     :,
                 ] = dst_with_border
 
-        # Resize the combined image and display it
-        view_image = cv2.resize(combined_images, (0, 0), fx=0.2, fy=0.2)
+            # Resize the combined image and display it
+            view_image = cv2.resize(combined_images, (0, 0), fx=view_scale, fy=view_scale)
         # Save the combined image to the image_buffer for future saving
         self.image_buffer = combined_images
+        self.combined_images = combined_images
 
-        self.update_image_grid(view_image)
+        recording = self.recording
+        if recording is not None:
+            recording.submit_grid(combined_images, self.grid_frames)
+
+        with frame_trace.span("display"):
+            self.update_image_grid(view_image)
+        return True
 
     def save_image(self):
         assert self.image_buffer is not None, "No image to save"
@@ -432,10 +699,12 @@ class ImageSaverApp:
         image_filename = f"image_{experiment[4]}.jpg"
         comment_filename = f"image_{experiment[4]}.txt"
 
-        # Save the image and update the image count
+        # Save the image and update the image count. With scene_change enabled, the cells of unchanged
+        # cameras come from earlier frame sets (at most refresh_interval seconds older)
         image_path = os.path.join(subfolder_path, image_filename)
         comment_path = os.path.join(subfolder_path, comment_filename)
-        cv2.imwrite(image_path, self.image_buffer)
+        with frame_trace.span("save", image_count=experiment[4]):
+            cv2.imwrite(image_path, self.image_buffer)
         print(f"Saved image {experiment[4]} as {image_path}")
 
         # Update the image count label and reset the image buffer
@@ -476,25 +745,46 @@ class ImageSaverApp:
             subprocess.run(["xdg-open", os.path.abspath(self.save_directory_path)])
 
 
+# Write the spans recorded while tracing was enabled as a Chrome trace-event JSON file
+def export_trace():
+    tracer = frame_trace.disable_tracing()
+    if tracer is None:
+        return
+    trace_directory = tracing_config.get("directory", "traces/")
+    os.makedirs(trace_directory, exist_ok=True)
+    tracer.export(os.path.join(trace_directory, time.strftime("trace_%Y%m%d_%H%M%S.json")))
+
+
 # Function to properly close the camera when the application is closed
 def on_closing(destory_root=True):
     start_time = time.time()
 
     print("Closing application...")
     print(f"Before closing cameras, total threads number: {threading.active_count()}")
-    closing_threads = []
-    for frame in app.frame_list:
-        # Camera_off(frame)
-        closing_threads.append(threading.Thread(target=Camera_off, args=(frame,), daemon=True))
-        closing_threads[-1].start()
-
-    for thread in closing_threads:
-        thread.join()
-
-    system.destroy_device()
+    # Stop the watchdog first, so it does not restart cameras that are being closed
+    app.stop_watchdog()
+    app.stop_recording()
+    app.stop_frame_bus()
+    if app.coordinator is not None:
+        # The shards close their own cameras and devices
+        app.coordinator.close()
+        app.coordinator = None
+    else:
+        closing_threads = []
+        for frame in app.frame_list:
+            # Camera_off(frame)
+            closing_threads.append(threading.Thread(target=Camera_off, args=(frame,), daemon=True))
+            closing_threads[-1].start()
+
+        for thread in closing_threads:
+            thread.join()
+
+        if not simulate_devices and not replay_config:
+            system.destroy_device()
     print(f"After closing cameras, total threads number: {threading.active_count()}")
 
     if destory_root:
+        export_trace()
         app.root.destroy()
 
     end_time = time.time()
@@ -5,12 +5,18 @@ import numpy as np
 import cv2
 import os
 import traceback
-from arena_api.system import system
-from arena_api.buffer import BufferFactory
-from arena_api.__future__.save import Writer
+try:
+    from arena_api.system import system
+    from arena_api.buffer import BufferFactory
+    from arena_api.__future__.save import Writer
+except ImportError:
+    # Simulated and replayed devices work without the Arena SDK
+    system = BufferFactory = Writer = None
 from multiprocessing import Value
 import json
 import time
+from collections import deque
+import frame_trace
 
 width1 = 2048
 height1 = 1536
@@ -38,7 +44,207 @@ def get_node_value(nodemap, node):
         return None
 
 
+def get_node_value_quiet(nodemap, node):
+    # Same as get_node_value but without the "not found" print, for nodes polled every frame
+    try:
+        node_obj = nodemap.get_node(node)
+        return node_obj.value if node_obj is not None else None
+    except Exception:
+        return None
+
+
+# Transport layer stream counters polled from tl_stream_nodemap (cumulative since stream start)
+STREAM_COUNTER_NODES = {
+    "missed_packets": "StreamMissedPacketCount",
+    "resend_requests": "StreamResendRequestCount",
+    "lost_frames": "StreamLostFrameCount",
+}
+# Buffer queue fill level is StreamOutputBufferCount / StreamAnnouncedBufferCount
+STREAM_OUTPUT_BUFFER_NODE = "StreamOutputBufferCount"
+STREAM_ANNOUNCED_BUFFER_NODE = "StreamAnnouncedBufferCount"
+
+
+class Stream_Stats:
+    """Rolling stream health statistics of one camera.
+
+    Frame id gaps and incomplete buffers are recorded for every frame, the transport layer
+    counters are polled at most every counter_poll_interval seconds. All figures are reported
+    over the last `window` frames. A threshold set to None disables its warning.
+    """
+
+    def __init__(self, which_camera, window=60, thresholds=None, counter_poll_interval=1.0):
+        self.which_camera = which_camera
+        self.thresholds = thresholds or {}
+        self.counter_poll_interval = counter_poll_interval
+        self.lock = threading.Lock()
+        # Per frame samples: (dropped_frames, is_incomplete)
+        self.frames = deque(maxlen=window)
+        # Counter samples: (time, {name: cumulative value})
+        self.counter_samples = deque(maxlen=window)
+        self.last_frame_id = None
+        self.last_poll_time = 0.0
+        self.buffer_fill = None
+        self.total_frames = 0
+        self.total_dropped = 0
+        self.total_incomplete = 0
+
+    def reset_stream(self):
+        # Frame ids and transport counters restart together with the stream
+        with self.lock:
+            self.last_frame_id = None
+            self.counter_samples.clear()
+
+    def update_frame(self, frame_id, is_incomplete):
+        with self.lock:
+            dropped = 0
+            if frame_id is not None and self.last_frame_id is not None and frame_id > self.last_frame_id:
+                dropped = frame_id - self.last_frame_id - 1
+            if frame_id is not None:
+                self.last_frame_id = frame_id
+            self.frames.append((dropped, bool(is_incomplete)))
+            self.total_frames += 1
+            self.total_dropped += dropped
+            self.total_incomplete += int(bool(is_incomplete))
+
+    def poll_counters(self, tl_stream_nodemap):
+        now = time.time()
+        if now - self.last_poll_time < self.counter_poll_interval:
+            return
+        self.last_poll_time = now
+
+        counters = {}
+        for name, node in STREAM_COUNTER_NODES.items():
+            value = get_node_value_quiet(tl_stream_nodemap, node)
+            if value is not None:
+                counters[name] = value
+        output_buffers = get_node_value_quiet(tl_stream_nodemap, STREAM_OUTPUT_BUFFER_NODE)
+        announced_buffers = get_node_value_quiet(tl_stream_nodemap, STREAM_ANNOUNCED_BUFFER_NODE)
+
+        with self.lock:
+            self.counter_samples.append((now, counters))
+            if output_buffers is not None and announced_buffers:
+                self.buffer_fill = output_buffers / announced_buffers
+
+    def summary(self):
+        with self.lock:
+            result = {
+                "frames": len(self.frames),
+                "dropped_frames": sum(dropped for dropped, _ in self.frames),
+                "incomplete_frames": sum(1 for _, incomplete in self.frames if incomplete),
+                "buffer_fill": self.buffer_fill,
+                "total_frames": self.total_frames,
+                "total_dropped": self.total_dropped,
+                "total_incomplete": self.total_incomplete,
+            }
+            # Counter deltas over the window
+            for name in STREAM_COUNTER_NODES:
+                result[name] = None
+            if self.counter_samples:
+                first = self.counter_samples[0][1]
+                last = self.counter_samples[-1][1]
+                for name, value in last.items():
+                    result[name] = value - first.get(name, value)
+        return result
+
+    def warnings(self):
+        summary = self.summary()
+        messages = []
+        for name, threshold in self.thresholds.items():
+            value = summary.get(name)
+            if threshold is None or value is None:
+                continue
+            if value >= threshold:
+                if name == "buffer_fill":
+                    messages.append(f"Camera_{self.which_camera} {name} {value:.0%} >= {threshold:.0%}")
+                else:
+                    messages.append(f"Camera_{self.which_camera} {name} {value} >= {threshold}")
+        return messages
+
+
+def set_aligned_node_value(nodemap, node, value, round_up=False):
+    # Integer nodes only accept multiples of their increment within [min, max]
+    node_obj = nodemap.get_node(node)
+    if node_obj is None:
+        print(f"Node {node} not found")
+        return None
+    inc = getattr(node_obj, "inc", None) or 1
+    value = -(-value // inc) * inc if round_up else value // inc * inc
+    node_max = getattr(node_obj, "max", None)
+    if node_max is not None and value > node_max:
+        value = node_max // inc * inc
+    node_min = getattr(node_obj, "min", None)
+    if node_min is not None and value < node_min:
+        value = node_min
+    node_obj.value = value
+    return node_obj.value
+
+
+def apply_acquisition_geometry(nodemap, acquisition):
+    """Push binning/decimation and the sensor ROI to the camera and read back what it applied.
+
+    acquisition is {"sensor_roi": (offset_x, offset_y, width, height) or None for the full sensor,
+    "binning": factor, "binning_mode": "binning" or "decimation"}, in full resolution sensor pixels.
+    Returns (offset_x, offset_y, width, height, binning, binning_mode) in full resolution pixels.
+    """
+    acquisition = acquisition or {}
+    binning = acquisition.get("binning", 1)
+    binning_mode = acquisition.get("binning_mode", "binning")
+
+    # Binning first, Width/Height/Offset are expressed in binned pixels
+    if binning_mode == "decimation":
+        set_node_value(nodemap, "BinningHorizontal", 1)
+        set_node_value(nodemap, "BinningVertical", 1)
+        set_node_value(nodemap, "DecimationHorizontal", binning)
+        set_node_value(nodemap, "DecimationVertical", binning)
+    else:
+        set_node_value(nodemap, "DecimationHorizontal", 1)
+        set_node_value(nodemap, "DecimationVertical", 1)
+        set_node_value(nodemap, "BinningHorizontal", binning)
+        set_node_value(nodemap, "BinningVertical", binning)
+
+    # Reset the offsets so the whole Width/Height range is available
+    set_node_value(nodemap, "OffsetX", 0)
+    set_node_value(nodemap, "OffsetY", 0)
+
+    sensor_roi = acquisition.get("sensor_roi")
+    if sensor_roi is None:
+        for node in ("Width", "Height"):
+            node_obj = nodemap.get_node(node)
+            set_aligned_node_value(nodemap, node, getattr(node_obj, "max", node_obj.value))
+    else:
+        offset_x, offset_y, width, height = sensor_roi
+        # Offsets round down and sizes round up, so the ROI still covers the requested region
+        offset_x_binned = offset_x // binning
+        offset_y_binned = offset_y // binning
+        end_x_binned = -(-(offset_x + width) // binning)
+        end_y_binned = -(-(offset_y + height) // binning)
+        inc_x = getattr(nodemap.get_node("OffsetX"), "inc", None) or 1
+        inc_y = getattr(nodemap.get_node("OffsetY"), "inc", None) or 1
+        offset_x_binned = offset_x_binned // inc_x * inc_x
+        offset_y_binned = offset_y_binned // inc_y * inc_y
+        set_aligned_node_value(nodemap, "Width", end_x_binned - offset_x_binned, round_up=True)
+        set_aligned_node_value(nodemap, "Height", end_y_binned - offset_y_binned, round_up=True)
+        set_aligned_node_value(nodemap, "OffsetX", offset_x_binned)
+        set_aligned_node_value(nodemap, "OffsetY", offset_y_binned)
+
+    # Read back the factor the camera actually uses
+    if binning_mode == "decimation":
+        binning = get_node_value(nodemap, "DecimationHorizontal") or binning
+    else:
+        binning = get_node_value(nodemap, "BinningHorizontal") or binning
+    return (
+        get_node_value(nodemap, "OffsetX") * binning,
+        get_node_value(nodemap, "OffsetY") * binning,
+        get_node_value(nodemap, "Width") * binning,
+        get_node_value(nodemap, "Height") * binning,
+        binning,
+        binning_mode,
+    )
+
+
 def create_devices_with_tries():
+    if system is None:
+        raise Exception("arena_api is not installed. Use simulate_devices or replay in config.yaml.")
     start_time = time.time()
     with threading.Lock():
         tries = 0
@@ -64,24 +270,41 @@ def create_devices_with_tries():
             raise Exception(f"No device found! Please connect a device and run " f"the example again.")
 
 
-def Camera_On(Set_exposure, which_camera, device):
+def Camera_On(Set_exposure, which_camera, device, stream_stats_config=None, acquisition=None):
     class Video_Capture:
         def __init__(self, Set_exposure, which_camera, device):
             start_time = time.time()
+            stats_config = stream_stats_config or {}
+            self.stream_stats = Stream_Stats(
+                which_camera,
+                window=stats_config.get("window", 60),
+                thresholds=stats_config.get("thresholds"),
+                counter_poll_interval=stats_config.get("counter_poll_interval", 1.0),
+            )
             self.frame_holder = None
+            self.frame_id = None
+            self.frame_timestamp_ns = None
+            # Callables (npndarray, which_camera, frame_id, timestamp_ns) run in the capture thread
+            self.frame_listeners = []
             self.device = device
             self.which_camera = which_camera
             self.working_properly = False
             self.num_channels = 3
             self.ready_to_stop = threading.Event()
             self.stopped = threading.Event()
+            # Health state read by the Camera_Watchdog
+            self.failed = threading.Event()
+            self.last_error = None
+            self.last_frame_time = None
+            self.stream_start_time = None
+            self.stream_lock = threading.Lock()
             self.setup(Set_exposure)
             end_time = time.time()
             print(f"Camera_{which_camera} initialization took {end_time - start_time} seconds.")
 
         # Start stream in a separate thread
         def startProcess(self):
-            self.t = threading.Thread(target=self.start_stream, args=())
+            self.t = threading.Thread(target=self.start_stream, args=(), name=f"camera_{self.which_camera}")
             self.t.daemon = True
             self.t.start()
 
@@ -108,6 +331,9 @@ def Camera_On(Set_exposure, which_camera, device):
             set_node_value(device.tl_stream_nodemap, "StreamBufferHandlingMode", "OldestFirst")
             set_node_value(device.nodemap, "PixelFormat", "BGR8")
 
+            # Sensor ROI and binning/decimation, the undistortion maps follow the geometry read back here
+            self.acquisition_geometry = apply_acquisition_geometry(device.nodemap, acquisition)
+
             i = self.which_camera
             if i == 0:  # camera_0
                 set_node_value(device.nodemap, "PtpSlaveOnly", False)
@@ -134,66 +360,135 @@ def Camera_On(Set_exposure, which_camera, device):
 
             return self.num_channels
 
+        def buffer_to_array(self, buffer):
+            # Simulated devices hand out numpy frames directly
+            copy_buffer = getattr(self.device, "copy_buffer", None)
+            if copy_buffer is not None:
+                return copy_buffer(buffer)
+
+            # Convert buffer data to a numpy array
+            item = BufferFactory.copy(buffer)
+            buffer_bytes_per_pixel = int(len(item.data) / (item.width * item.height))
+            array = (ctypes.c_ubyte * self.num_channels * item.width * item.height).from_address(
+                ctypes.addressof(item.pbytes)
+            )
+            npndarray = np.ndarray(
+                buffer=array,
+                dtype=np.uint8,
+                shape=(item.height, item.width, buffer_bytes_per_pixel),
+            )
+
+            # Make a deep copy of the numpy array
+            npndarray_copy = np.copy(npndarray)
+
+            # Reset the memory usgae of the buffer
+            BufferFactory.destroy(item)
+            return npndarray_copy
+
         def start_stream(self):
             safe_print(f"Camera_{self.which_camera} starts streaming.")
-
-            while not self.working_properly:
+            self.stream_start_time = time.time()
+
+            try:
+                self.device.start_stream()
+                self.stream_stats.reset_stream()
+                self.working_properly = True
+
+                # Continuously get buffer
+                while True:
+                    if self.stopped.is_set():
+                        break
+
+                    start_time = time.time()
+                    trace_start = frame_trace.now()
+                    buffer = self.device.get_buffer()
+                    frame_trace.record("get_buffer", trace_start, camera=self.which_camera, frame_id=buffer.frame_id)
+                    self.stream_stats.update_frame(buffer.frame_id, buffer.is_incomplete)
+                    self.stream_stats.poll_counters(self.device.tl_stream_nodemap)
+
+                    trace_start = frame_trace.now()
+                    npndarray_copy = self.buffer_to_array(buffer)
+                    frame_trace.record("copy", trace_start, camera=self.which_camera, frame_id=buffer.frame_id)
+
+                    # Save the deep copy of the buffer to the holder, with the id and timestamp it belongs to
+                    self.frame_holder = (npndarray_copy, self.which_camera, buffer.frame_id, buffer.timestamp_ns)
+                    self.frame_id = buffer.frame_id
+                    self.frame_timestamp_ns = buffer.timestamp_ns
+                    self.last_frame_time = time.time()
+                    with frame_trace.span("listeners", camera=self.which_camera, frame_id=buffer.frame_id):
+                        self.notify_frame_listeners(npndarray_copy, buffer.frame_id, buffer.timestamp_ns)
+
+                    self.device.requeue_buffer(buffer)
+                    end_time = time.time()
+                    print(f"Camera_{which_camera} frame update took {end_time - start_time} seconds.")
+            except EOFError:
+                # A replay device reached the end of its recording, the last frame stays in the holder
+                safe_print(f"Camera_{self.which_camera} reached the end of its recording.")
+            except Exception as e:
+                # Errors raised while the stream is torn down on purpose are expected
+                if self.stopped.is_set():
+                    return
+                print(f"Some error happened! Camera_{self.which_camera} is left to the watchdog...")
+                traceback.print_exc()
+                self.last_error = e
+                self.failed.set()
+
+        # Tear down and restart only this camera's stream. Returns False if the old capture thread
+        # could not be stopped, in which case the caller should try again later.
+        def restart_stream(self, join_timeout=5.0):
+            with self.stream_lock:
+                self.stopped.set()
+                try:
+                    # Also unblocks a get_buffer call that is stuck waiting for a frame
+                    self.device.stop_stream()
+                except Exception:
+                    pass
+                self.t.join(timeout=join_timeout)
+                if self.t.is_alive():
+                    print(f"Camera_{self.which_camera} capture thread did not stop.")
+                    return False
+
+                self.stopped.clear()
+                self.failed.clear()
+                self.last_error = None
+                self.startProcess()
+                return True
+
+        def add_frame_listener(self, listener):
+            self.frame_listeners = self.frame_listeners + [listener]
+
+        def remove_frame_listener(self, listener):
+            self.frame_listeners = [l for l in self.frame_listeners if l != listener]
+
+        def notify_frame_listeners(self, npndarray, frame_id, timestamp_ns):
+            # Listeners must not block, and their errors must not stop the capture
+            for listener in self.frame_listeners:
                 try:
-                    self.device.start_stream()
-                    self.working_properly = True
-
-                    # Continuously get buffer
-                    while True:
-                        if self.stopped.is_set():
-                            break
-
-                        start_time = time.time()
-                        buffer = self.device.get_buffer()
-
-                        # Convert buffer data to a numpy array
-                        item = BufferFactory.copy(buffer)
-                        buffer_bytes_per_pixel = int(len(item.data) / (item.width * item.height))
-                        array = (ctypes.c_ubyte * self.num_channels * item.width * item.height).from_address(
-                            ctypes.addressof(item.pbytes)
-                        )
-                        npndarray = np.ndarray(
-                            buffer=array,
-                            dtype=np.uint8,
-                            shape=(item.height, item.width, buffer_bytes_per_pixel),
-                        )
-
-                        # Make a deep copy of the numpy array
-                        npndarray_copy = np.copy(npndarray)
-
-                        # Save the deep copy of the buffer to the holder
-                        self.frame_holder = (npndarray_copy, self.which_camera)
-
-                        # Reset the memory usgae of the buffer
-                        BufferFactory.destroy(item)
-                        self.device.requeue_buffer(buffer)
-                        end_time = time.time()
-                        print(f"Camera_{which_camera} frame update took {end_time - start_time} seconds.")
-                except Exception as e:
-                    print(f"Some error happened! Trying to reopen camera_{self.which_camera}...")
+                    listener(npndarray, self.which_camera, frame_id, timestamp_ns)
+                except Exception:
                     traceback.print_exc()
-                    time.sleep(3)
 
         def read(self):
             return_holder = self.frame_holder
             # self.frame_holder = None
             return return_holder
 
-        def stop_stream(self):
-            if self.working_properly:
+        def stop_stream(self, join_timeout=5.0):
+            with self.stream_lock:
+                if not self.working_properly:
+                    return
                 self.stopped.set()
-                self.t.join()
                 try:
+                    # Also unblocks a get_buffer call of a stalled camera, which would otherwise wait forever
                     self.device.stop_stream()
                     print(
                         f"Shutting camera_{self.which_camera} (Status: {get_node_value(self.device.nodemap, 'PtpStatus')})"
                     )
                 except:
                     print(f"Error stopping camera_{self.which_camera}")
+                self.t.join(timeout=join_timeout)
+                if self.t.is_alive():
+                    print(f"Camera_{self.which_camera} capture thread did not stop.")
 
     frame0 = Video_Capture(Set_exposure, which_camera, device)
     return frame0
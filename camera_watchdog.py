@@ -0,0 +1,189 @@
+import threading
+import time
+
+
+PTP_HEALTHY_STATUSES = ("Master", "Slave")
+
+
+class Camera_Watchdog:
+    """Supervises the capture threads and restarts only the stream of a failed camera.
+
+    A camera is considered failed when its capture thread raised, when no frame arrived for
+    frame_timeout seconds, or when its PtpStatus left Master/Slave. Restarts of the same camera
+    are spaced by an exponential backoff capped at backoff_max seconds, the other cameras keep
+    streaming. Recovery events and downtime are recorded per camera, see report().
+    """
+
+    def __init__(
+        self,
+        frame_list,
+        frame_timeout=5.0,
+        check_interval=1.0,
+        backoff_initial=1.0,
+        backoff_max=30.0,
+        startup_grace=10.0,
+        check_ptp=True,
+    ):
+        self.frame_list = frame_list
+        self.frame_timeout = frame_timeout
+        self.check_interval = check_interval
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.startup_grace = startup_grace
+        self.check_ptp = check_ptp
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.t = None
+        self.restart_threads = {}
+
+        self.health = {}
+        for frame in frame_list:
+            self.health[frame.which_camera] = {
+                "down_since": None,
+                "pending_restart_time": None,
+                "restart_time": None,
+                "attempts": 0,
+                "restarts": 0,
+                "recoveries": 0,
+                "downtime": 0.0,
+                "events": [],
+            }
+
+    def start(self):
+        self.t = threading.Thread(target=self.run, args=())
+        self.t.daemon = True
+        self.t.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.t is not None:
+            self.t.join()
+        # A restart still running would start a stream of a camera that is being closed
+        for restart_thread in list(self.restart_threads.values()):
+            restart_thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.check_interval):
+            for frame in self.frame_list:
+                if self.stopped.is_set():
+                    break
+                try:
+                    self.supervise(frame)
+                except Exception as e:
+                    print(f"Watchdog failed to supervise camera_{frame.which_camera}: {e}")
+
+    def backoff(self, attempts):
+        return min(self.backoff_initial * 2**attempts, self.backoff_max)
+
+    def record_event(self, state, which_camera, event, **details):
+        entry = {"time": time.time(), "event": event, **details}
+        state["events"].append(entry)
+        details_text = ", ".join(f"{key}: {value}" for key, value in details.items())
+        print(f"Watchdog camera_{which_camera} {event} ({details_text})")
+
+    # Returns the reason the camera is considered failed, or None if it is healthy
+    def check(self, frame, now=None):
+        now = time.time() if now is None else now
+        state = self.health[frame.which_camera]
+
+        # A replay device that reached the end of its recording stops sending frames on purpose
+        if getattr(frame.device, "finished", False):
+            return None
+
+        if frame.failed.is_set():
+            return f"exception: {frame.last_error!r}"
+
+        # Frames are expected within frame_timeout of the last frame or of the last (re)start
+        reference_times = [frame.last_frame_time, frame.stream_start_time, state["restart_time"]]
+        reference_times = [t for t in reference_times if t is not None]
+        if reference_times and now - max(reference_times) > self.frame_timeout:
+            return f"no frame for {now - max(reference_times):.1f} seconds"
+
+        started = max(t for t in (frame.stream_start_time, state["restart_time"], 0.0) if t is not None)
+        if self.check_ptp and now - started > self.startup_grace:
+            ptp_status = frame.device.nodemap.get_node("PtpStatus").value
+            if ptp_status not in PTP_HEALTHY_STATUSES:
+                return f"PTP status {ptp_status}"
+
+        return None
+
+    def supervise(self, frame, now=None):
+        now = time.time() if now is None else now
+        which_camera = frame.which_camera
+        state = self.health[which_camera]
+
+        # Not supervised again until its restart finished
+        restart_thread = self.restart_threads.get(which_camera)
+        if restart_thread is not None and restart_thread.is_alive():
+            return
+
+        with self.lock:
+            if state["pending_restart_time"] is not None:
+                if now < state["pending_restart_time"]:
+                    return
+                state["pending_restart_time"] = None
+                state["restart_time"] = now
+                state["restarts"] += 1
+                self.record_event(state, which_camera, "restart", attempt=state["attempts"])
+                # restart_stream can block for its join timeout, the other cameras and report() must not wait
+                restart_thread = threading.Thread(
+                    target=self.restart, args=(frame,), name=f"restart_{which_camera}", daemon=True
+                )
+                self.restart_threads[which_camera] = restart_thread
+                restart_thread.start()
+                return
+
+            reason = self.check(frame, now)
+            if reason is not None:
+                if state["down_since"] is None:
+                    # A stalled camera has been down since its last frame
+                    if frame.last_frame_time is not None and reason.startswith("no frame"):
+                        state["down_since"] = frame.last_frame_time
+                    else:
+                        state["down_since"] = now
+                    self.record_event(state, which_camera, "failure", reason=reason)
+                delay = self.backoff(state["attempts"])
+                state["attempts"] += 1
+                state["pending_restart_time"] = now + delay
+                print(f"Restarting camera_{which_camera} in {delay:.1f} seconds (attempt {state['attempts']}).")
+                return
+
+            # Recovered once a frame arrived after the last restart
+            if (
+                state["down_since"] is not None
+                and frame.last_frame_time is not None
+                and state["restart_time"] is not None
+                and frame.last_frame_time > state["restart_time"]
+            ):
+                downtime = frame.last_frame_time - state["down_since"]
+                state["downtime"] += downtime
+                state["recoveries"] += 1
+                self.record_event(
+                    state, which_camera, "recovered", downtime=round(downtime, 3), attempts=state["attempts"]
+                )
+                state["down_since"] = None
+                state["attempts"] = 0
+
+    def restart(self, frame):
+        if not frame.restart_stream():
+            state = self.health[frame.which_camera]
+            with self.lock:
+                self.record_event(state, frame.which_camera, "restart failed", attempt=state["attempts"])
+
+    def report(self):
+        # Per camera summary of restarts, recoveries and downtime, including a still ongoing outage
+        now = time.time()
+        with self.lock:
+            result = {}
+            for which_camera, state in self.health.items():
+                downtime = state["downtime"]
+                if state["down_since"] is not None:
+                    downtime += now - state["down_since"]
+                result[which_camera] = {
+                    "down": state["down_since"] is not None,
+                    "restarts": state["restarts"],
+                    "recoveries": state["recoveries"],
+                    "downtime": downtime,
+                    "events": list(state["events"]),
+                }
+        return result
@@ -0,0 +1,173 @@
+import threading
+import math
+import time
+import numpy as np
+
+
+class Fake_Node:
+    def __init__(self, value=None, min=None, max=None, inc=None):
+        self.value = value
+        self.min = min
+        self.max = max
+        self.inc = inc
+
+
+class Fake_Nodemap:
+    """Dictionary backed stand-in for an arena_api nodemap. Unknown nodes return None like Arena."""
+
+    def __init__(self, values, limits=None):
+        limits = limits or {}
+        self.nodes = {name: Fake_Node(value, *limits.get(name, ())) for name, value in values.items()}
+
+    def get_node(self, node):
+        return self.nodes.get(node)
+
+    def __getitem__(self, node):
+        return self.nodes[node]
+
+
+class Fake_Buffer:
+    def __init__(self, array, frame_id, timestamp_ns, is_incomplete=False):
+        self.array = array
+        self.frame_id = frame_id
+        self.timestamp_ns = timestamp_ns
+        self.is_incomplete = is_incomplete
+        self.height, self.width = array.shape[:2]
+
+
+class Fake_Device:
+    """Simulated camera with the parts of the arena_api device interface used by Video_Capture.
+
+    Frames are generated at PTPSyncFrameRate. Faults can be injected with inject_fault():
+        "get_buffer_error": the next get_buffer call(s) raise
+        "start_stream_error": the next start_stream call(s) raise
+        "stall": get_buffer blocks until stop_stream is called
+        "ptp_lost": PtpStatus reports "Disabled" until the stream is restarted
+    """
+
+    def __init__(self, mac_address, width=2048, height=1536, ptp_status="Slave"):
+        self.width = width
+        self.height = height
+        self.nodemap = Fake_Nodemap(
+            {
+                "DeviceSerialNumber": f"FAKE{mac_address & 0xFFFFFF:08d}",
+                "GevMACAddress": mac_address,
+                "ExposureAuto": "Continuous",
+                "ExposureTime": 5000.0,
+                "PtpEnable": False,
+                "PtpSlaveOnly": False,
+                "PtpStatus": ptp_status,
+                "PixelFormat": "BGR8",
+                "GevSCPD": 0,
+                "GevSCFTD": 0,
+                "AcquisitionStartMode": "Normal",
+                "PTPSyncFrameRate": 1.0,
+                "Width": width,
+                "Height": height,
+                "OffsetX": 0,
+                "OffsetY": 0,
+                "BinningHorizontal": 1,
+                "BinningVertical": 1,
+                "DecimationHorizontal": 1,
+                "DecimationVertical": 1,
+            },
+            # (min, max, inc) of the geometry nodes, the binned limits are not simulated
+            limits={
+                "Width": (8, width, 8),
+                "Height": (2, height, 2),
+                "OffsetX": (0, width - 8, 8),
+                "OffsetY": (0, height - 2, 2),
+            },
+        )
+        self.tl_stream_nodemap = Fake_Nodemap(
+            {
+                "StreamAutoNegotiatePacketSize": False,
+                "StreamPacketResendEnable": False,
+                "StreamBufferHandlingMode": "OldestFirst",
+                "StreamMissedPacketCount": 0,
+                "StreamResendRequestCount": 0,
+                "StreamLostFrameCount": 0,
+                "StreamOutputBufferCount": 0,
+                "StreamAnnouncedBufferCount": 10,
+            }
+        )
+        self.ptp_status = ptp_status
+        self.streaming = threading.Event()
+        self.faults = {}
+        self.lock = threading.Lock()
+        self.frame_id = 0
+        self.last_trigger = None
+        self.base_frame = None
+
+    def inject_fault(self, kind, count=1):
+        with self.lock:
+            self.faults[kind] = self.faults.get(kind, 0) + count
+        if kind == "ptp_lost":
+            self.nodemap["PtpStatus"].value = "Disabled"
+
+    def take_fault(self, kind):
+        with self.lock:
+            if self.faults.get(kind, 0) > 0:
+                self.faults[kind] -= 1
+                return True
+            return False
+
+    def start_stream(self, *args):
+        if self.take_fault("start_stream_error"):
+            raise RuntimeError("Injected start_stream fault")
+        if self.take_fault("ptp_lost"):
+            self.nodemap["PtpStatus"].value = self.ptp_status
+        # A fixed gradient of the configured Width/Height, so frames are cheap to produce but not blank
+        width, height = self.nodemap["Width"].value, self.nodemap["Height"].value
+        self.base_frame = np.broadcast_to(
+            np.linspace(0, 255, width, dtype=np.uint8)[None, :, None], (height, width, 3)
+        )
+        self.last_trigger = None
+        self.streaming.set()
+
+    def stop_stream(self):
+        if not self.streaming.is_set():
+            raise RuntimeError("Stream is not started")
+        self.streaming.clear()
+
+    def get_buffer(self, timeout=None):
+        if not self.streaming.is_set():
+            raise RuntimeError("Stream is not started")
+        if self.take_fault("get_buffer_error"):
+            raise RuntimeError("Injected get_buffer fault")
+        if self.take_fault("stall"):
+            while self.streaming.is_set():
+                time.sleep(0.01)
+            raise RuntimeError("Stream stopped while waiting for a buffer")
+
+        # Triggered on a time grid shared by all fake cameras, like PTPSync, so their frames of a trigger
+        # carry the same timestamp; frames of triggers that passed while the caller was busy are queued
+        period = 1.0 / self.nodemap["PTPSyncFrameRate"].value
+        if self.last_trigger is None:
+            trigger = (math.floor(time.time() / period) + 1) * period
+        else:
+            trigger = self.last_trigger + period
+        self.last_trigger = trigger
+        delay = trigger - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if not self.streaming.is_set():
+            raise RuntimeError("Stream stopped while waiting for a buffer")
+
+        self.frame_id += 1
+        return Fake_Buffer(self.base_frame, self.frame_id, int(trigger * 1e9))
+
+    def copy_buffer(self, buffer):
+        return np.array(buffer.array)
+
+    def requeue_buffer(self, buffer):
+        pass
+
+
+def create_fake_devices(MAC_list, width=2048, height=1536):
+    # One simulated device per configured MAC address, the first one is the PTP master
+    devices = []
+    for i, mac_address in enumerate(MAC_list):
+        mac_value = int(mac_address.replace(":", ""), 16)
+        devices.append(Fake_Device(mac_value, width, height, ptp_status="Master" if i == 0 else "Slave"))
+    return devices
@@ -0,0 +1,221 @@
+import struct
+import time
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# One shared memory segment per camera: a control block followed by a ring of frame slots.
+# Control block: magic, which_camera, slot_count, slot_size, latest sequence (0 = no frame yet)
+BUS_MAGIC = b"AGFRBUS1"
+CONTROL = struct.Struct("<8sIIIQ")
+LATEST_SEQUENCE_OFFSET = 20
+# Slot header: sequence when the write started, sequence when it finished, timestamp_ns, frame_id,
+# height, width, channels, which_camera. The pixels follow at SLOT_HEADER_SIZE.
+SLOT = struct.Struct("<QQqqIIII")
+CONTROL_SIZE = 64
+SLOT_HEADER_SIZE = 64
+
+
+def segment_name(name, which_camera):
+    return f"{name}_{which_camera}"
+
+
+def slot_offset(slot, slot_size):
+    return CONTROL_SIZE + slot * (SLOT_HEADER_SIZE + slot_size)
+
+
+class Frame_Bus_Writer:
+    """Writes one camera's frames into a shared memory ring of `slots` frames.
+
+    The writer never waits for readers. A frame stays readable until `slots - 1` newer frames
+    have been written; readers detect an overwritten slot through its sequence numbers.
+    """
+
+    def __init__(self, name, which_camera, max_frame_bytes, slots=4):
+        self.which_camera = which_camera
+        self.slots = slots
+        # Keep every slot's pixels 64 byte aligned
+        self.slot_size = -(-max_frame_bytes // 64) * 64
+        size = CONTROL_SIZE + slots * (SLOT_HEADER_SIZE + self.slot_size)
+        try:
+            self.shm = shared_memory.SharedMemory(name=segment_name(name, which_camera), create=True, size=size)
+        except FileExistsError:
+            # Left behind by a publisher that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=segment_name(name, which_camera))
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=segment_name(name, which_camera), create=True, size=size)
+        CONTROL.pack_into(self.shm.buf, 0, BUS_MAGIC, which_camera, slots, self.slot_size, 0)
+        self.sequence = 0
+        self.frames_skipped = 0
+
+    def write(self, npndarray, frame_id, timestamp_ns):
+        if npndarray.nbytes > self.slot_size:
+            self.frames_skipped += 1
+            return
+        self.sequence += 1
+        sequence = self.sequence
+        offset = slot_offset(sequence % self.slots, self.slot_size)
+        height, width = npndarray.shape[:2]
+        channels = npndarray.shape[2] if npndarray.ndim == 3 else 1
+
+        # Seqlock: readers only trust a slot whose start and end sequence agree
+        SLOT.pack_into(
+            self.shm.buf,
+            offset,
+            sequence,
+            0,
+            timestamp_ns or 0,
+            frame_id or 0,
+            height,
+            width,
+            channels,
+            self.which_camera,
+        )
+        pixels = np.ndarray(npndarray.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset + SLOT_HEADER_SIZE)
+        pixels[...] = npndarray
+        struct.pack_into("<Q", self.shm.buf, offset + 8, sequence)
+        struct.pack_into("<Q", self.shm.buf, LATEST_SEQUENCE_OFFSET, sequence)
+
+    def close(self):
+        self.shm.close()
+        # Windows frees the segment with its last handle and has no resource tracker to work around
+        if os.name != "posix":
+            return
+        # A subscriber sharing this process' resource tracker (a spawned child or its parent) may have
+        # unregistered the segment already; register it again so unlink() can unregister it
+        resource_tracker.register(self.shm._name, "shared_memory")
+        self.shm.unlink()
+
+
+class Frame_Bus_Publisher:
+    """Publishes the latest frames of all cameras on the shared memory frame bus.
+
+    Frames are written from each camera's capture thread through its frame listener, so no
+    extra thread or queue is involved. Subscribers attach with Frame_Bus_Subscriber(name, index).
+    """
+
+    def __init__(self, frame_list, name="ag_cameras", slots=4):
+        self.frame_list = frame_list
+        self.writers = {}
+        for frame in frame_list:
+            _, _, width, height, binning, _ = frame.acquisition_geometry
+            max_frame_bytes = (width // binning) * (height // binning) * frame.num_channels
+            self.writers[frame.which_camera] = Frame_Bus_Writer(name, frame.which_camera, max_frame_bytes, slots)
+            frame.add_frame_listener(self.on_frame)
+        print(f"Publishing {len(frame_list)} camera(s) on frame bus {name}")
+
+    def on_frame(self, npndarray, which_camera, frame_id, timestamp_ns):
+        self.writers[which_camera].write(npndarray, frame_id, timestamp_ns)
+
+    def close(self):
+        for frame in self.frame_list:
+            frame.remove_frame_listener(self.on_frame)
+        for writer in self.writers.values():
+            writer.close()
+
+
+class Bus_Frame:
+    # A frame read from the bus; array is a view into shared memory, not a copy
+    def __init__(self, subscriber, sequence, array, frame_id, timestamp_ns, which_camera):
+        self.subscriber = subscriber
+        self.sequence = sequence
+        self.array = array
+        self.frame_id = frame_id
+        self.timestamp_ns = timestamp_ns
+        self.which_camera = which_camera
+
+    def valid(self):
+        # False once the publisher started overwriting this slot; check after using the array
+        return self.subscriber.slot_sequences(self.sequence)[0] == self.sequence
+
+
+class Frame_Bus_Subscriber:
+    """Reads one camera's frames from the shared memory frame bus of another process.
+
+    latest() returns the newest frame as a view into shared memory, without pickling or copying.
+    wait_for_frame() blocks the caller (never the publisher) until a newer frame is published.
+    Copy the array or check frame.valid() after using it if the reader may be slower than the
+    ring holds frames.
+    """
+
+    def __init__(self, name="ag_cameras", which_camera=0):
+        self.shm = shared_memory.SharedMemory(name=segment_name(name, which_camera))
+        # Attaching registers the segment with this process' resource tracker (POSIX only), which
+        # would unlink it on exit while the publisher still uses it
+        if os.name == "posix":
+            try:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+        magic, self.which_camera, self.slots, self.slot_size, _ = CONTROL.unpack_from(self.shm.buf, 0)
+        if magic != BUS_MAGIC:
+            raise ValueError(f"{segment_name(name, which_camera)} is not a frame bus segment")
+        self.last_sequence = 0
+
+    def latest_sequence(self):
+        return struct.unpack_from("<Q", self.shm.buf, LATEST_SEQUENCE_OFFSET)[0]
+
+    def slot_sequences(self, sequence):
+        offset = slot_offset(sequence % self.slots, self.slot_size)
+        return struct.unpack_from("<QQ", self.shm.buf, offset)
+
+    def read(self, sequence):
+        if sequence == 0:
+            return None
+        offset = slot_offset(sequence % self.slots, self.slot_size)
+        start, end, timestamp_ns, frame_id, height, width, channels, which_camera = SLOT.unpack_from(
+            self.shm.buf, offset
+        )
+        # Not written completely, or already overwritten by a newer frame
+        if start != sequence or end != sequence:
+            return None
+        array = np.ndarray(
+            (height, width, channels), dtype=np.uint8, buffer=self.shm.buf, offset=offset + SLOT_HEADER_SIZE
+        )
+        self.last_sequence = sequence
+        return Bus_Frame(self, sequence, array, frame_id, timestamp_ns, which_camera)
+
+    def latest(self):
+        return self.read(self.latest_sequence())
+
+    def wait_for_frame(self, timeout=None, poll_interval=0.001):
+        # Newest frame after the last one read, or None on timeout
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            sequence = self.latest_sequence()
+            if sequence > self.last_sequence:
+                frame = self.read(sequence)
+                if frame is not None:
+                    return frame
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.shm.close()
+
+
+# Minimal subscriber: prints the rate and latency of frames received from one camera
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Subscribe to a camera on the shared memory frame bus.")
+    parser.add_argument("--name", default="ag_cameras")
+    parser.add_argument("--camera", type=int, default=0)
+    args = parser.parse_args()
+
+    subscriber = Frame_Bus_Subscriber(args.name, args.camera)
+    count, start_time = 0, time.time()
+    while True:
+        frame = subscriber.wait_for_frame(timeout=5.0)
+        if frame is None:
+            print("No frame for 5 seconds.")
+            continue
+        count += 1
+        mean = float(frame.array.mean())
+        if not frame.valid():
+            print(f"Frame {frame.frame_id} was overwritten while reading it.")
+        if time.time() - start_time >= 1.0:
+            print(f"Camera_{frame.which_camera}: {count} frames/s, frame {frame.frame_id}, mean {mean:.1f}")
+            count, start_time = 0, time.time()
@@ -0,0 +1,108 @@
+import threading
+import contextlib
+import time
+import json
+import os
+from collections import deque
+
+
+# The active Frame_Tracer, None while tracing is disabled
+tracer = None
+
+
+class Frame_Tracer:
+    """Collects timed spans per thread and exports them as Chrome trace-event JSON.
+
+    Open the exported file in chrome://tracing or https://ui.perfetto.dev. Only the last
+    max_events spans are kept, so a long session can not exhaust memory.
+    """
+
+    def __init__(self, max_events=1000000):
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        # Spans that started before tracing was disabled may still be added while exporting
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, args):
+        tid = threading.get_ident()
+        with self.lock:
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+            self.events.append((name, start, end, tid, args))
+
+    def export(self, path):
+        with self.lock:
+            thread_names = list(self.thread_names.items())
+            events = list(self.events)
+        trace_events = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "ag_cameras"}}]
+        for tid, thread_name in thread_names:
+            trace_events.append(
+                {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": thread_name}}
+            )
+        for name, start, end, tid, args in events:
+            trace_events.append(
+                {
+                    "name": name,
+                    "cat": "frame",
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as json_file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, json_file)
+        print(f"Exported {len(trace_events)} trace events to {path}")
+
+
+def enable_tracing(max_events=1000000):
+    global tracer
+    tracer = Frame_Tracer(max_events)
+
+
+def disable_tracing():
+    # Returns the tracer that was active, so its spans can still be exported
+    global tracer
+    active_tracer, tracer = tracer, None
+    return active_tracer
+
+
+def now():
+    return time.perf_counter()
+
+
+def record(name, start, **args):
+    # Span from `start` (a now() value) until now; a no-op while tracing is disabled. Read the global
+    # once, disable_tracing() may run in another thread in between
+    active_tracer = tracer
+    if active_tracer is not None:
+        active_tracer.add(name, start, time.perf_counter(), args)
+
+
+class Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.start, **self.args)
+
+
+NULL_SPAN = contextlib.nullcontext()
+
+
+def span(name, **args):
+    # with span("process", camera=i, frame_id=frame_id): ... ; costs one check while disabled
+    if tracer is None:
+        return NULL_SPAN
+    return Span(name, args)
@@ -0,0 +1,286 @@
+import threading
+import queue
+import time
+import json
+import os
+import numpy as np
+import cv2
+import frame_trace
+from stream_replay import STREAM_EXTENSION, write_stream_header, write_stream_record
+
+
+# File extension of the video container per fourcc codec
+VIDEO_EXTENSIONS = {"MJPG": ".avi", "FFV1": ".mkv"}
+
+
+class Stream_Recorder:
+    """Encodes one stream (a camera or the composed grid) on its own thread.
+
+    submit() never blocks the caller: when the encoder falls behind and the queue is full the
+    frame is dropped and counted, and once close() started frames are ignored. Every written frame
+    gets a line in the sidecar csv with its frame id(s), device timestamp(s) and the host time it
+    was captured and written.
+    format is "video" (cv2.VideoWriter with the given fourcc codec), "raw" (frames appended to
+    chunk files of raw_chunk_frames frames each, shape and dtype in the json sidecar) or "stream"
+    (one compact file of raw frames with their frame ids and timestamps, replayable with
+    stream_replay.Replay_Device; metadata goes into its header).
+    """
+
+    def __init__(
+        self,
+        directory,
+        name,
+        fps,
+        format="video",
+        codec="MJPG",
+        queue_size=32,
+        raw_chunk_frames=100,
+        metadata=None,
+    ):
+        self.directory = directory
+        self.name = name
+        self.fps = fps
+        self.format = format
+        self.codec = codec
+        self.raw_chunk_frames = raw_chunk_frames
+        self.metadata = metadata or {}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = None
+        self.raw_file = None
+        self.shape = None
+        self.dtype = None
+
+        self.frames_written = 0
+        # Queue overflows are counted by the submitting thread, write failures by the encoder thread
+        self.frames_dropped = 0
+        self.frames_failed = 0
+        self.frames_missed = 0
+        self.last_frame_id = None
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        # Once closing, frames still submitted by a capture thread would sit behind the sentinel
+        self.closing = False
+        self.submit_lock = threading.Lock()
+
+        self.sidecar = open(os.path.join(directory, f"{name}.csv"), "w")
+        self.sidecar.write("frame_index,frame_id,timestamp_ns,capture_time,write_time\n")
+
+        self.t = threading.Thread(target=self.encode_loop, args=(), name=f"encoder_{name}")
+        self.t.daemon = True
+        self.t.start()
+
+    def submit(self, frame, frame_id, timestamp_ns):
+        # frame_id and timestamp_ns are lists for the grid, one entry per camera
+        with self.submit_lock:
+            if self.closing:
+                return
+            if self.last_frame_id is not None and isinstance(frame_id, int) and frame_id > self.last_frame_id + 1:
+                self.frames_missed += frame_id - self.last_frame_id - 1
+            self.last_frame_id = frame_id
+            try:
+                self.queue.put_nowait((frame, frame_id, timestamp_ns, time.time()))
+            except queue.Full:
+                self.frames_dropped += 1
+
+    def open_output(self, frame):
+        self.shape = frame.shape
+        self.dtype = frame.dtype
+        if self.format == "video":
+            extension = VIDEO_EXTENSIONS.get(self.codec, ".avi")
+            path = os.path.join(self.directory, f"{self.name}{extension}")
+            height, width = frame.shape[:2]
+            self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, (width, height))
+            if not self.writer.isOpened():
+                raise RuntimeError(f"Could not open {path} with codec {self.codec}")
+        elif self.format == "stream":
+            self.raw_file = open(os.path.join(self.directory, f"{self.name}{STREAM_EXTENSION}"), "wb")
+            write_stream_header(self.raw_file, {**self.metadata, "fps": self.fps, "shape": list(self.shape)})
+
+        with open(os.path.join(self.directory, f"{self.name}.json"), "w") as json_file:
+            json.dump(
+                {
+                    "format": self.format,
+                    "codec": self.codec if self.format == "video" else None,
+                    "fps": self.fps,
+                    "shape": list(self.shape),
+                    "dtype": str(self.dtype),
+                    "raw_chunk_frames": self.raw_chunk_frames if self.format == "raw" else None,
+                },
+                json_file,
+                indent=4,
+            )
+
+    def write_frame(self, frame, frame_id, timestamp_ns, capture_time):
+        if self.format == "video":
+            self.writer.write(frame)
+            return
+        if self.format == "stream":
+            write_stream_record(self.raw_file, frame, frame_id, timestamp_ns, capture_time)
+            return
+
+        # Start a new chunk file every raw_chunk_frames frames
+        if self.frames_written % self.raw_chunk_frames == 0:
+            if self.raw_file is not None:
+                self.raw_file.close()
+            chunk = self.frames_written // self.raw_chunk_frames
+            self.raw_file = open(os.path.join(self.directory, f"{self.name}_{chunk:05d}.raw"), "wb")
+        self.raw_file.write(np.ascontiguousarray(frame).data)
+
+    def encode_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame, frame_id, timestamp_ns, capture_time = item
+            try:
+                if self.shape is None:
+                    self.open_output(frame)
+                if frame.shape != self.shape:
+                    # Containers and raw chunks require a fixed geometry
+                    self.frames_failed += 1
+                    continue
+                with frame_trace.span("encode", stream=self.name, frame_id=frame_id):
+                    self.write_frame(frame, frame_id, timestamp_ns, capture_time)
+            except Exception as e:
+                print(f"Recording {self.name} failed to write a frame: {e}")
+                self.frames_failed += 1
+                continue
+
+            write_time = time.time()
+            lag = write_time - capture_time
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if isinstance(frame_id, list):
+                frame_id = ";".join(str(i) for i in frame_id)
+                timestamp_ns = ";".join(str(t) for t in timestamp_ns)
+            self.sidecar.write(f"{self.frames_written},{frame_id},{timestamp_ns},{capture_time:.6f},{write_time:.6f}\n")
+            self.frames_written += 1
+
+    def stats(self):
+        return {
+            "frames_written": self.frames_written,
+            "frames_dropped": self.frames_dropped + self.frames_failed,
+            "frames_missed": self.frames_missed,
+            "queue_depth": self.queue.qsize(),
+            "mean_lag": self.total_lag / self.frames_written if self.frames_written else 0.0,
+            "max_lag": self.max_lag,
+        }
+
+    def close(self):
+        with self.submit_lock:
+            self.closing = True
+        # Drain the queue before closing the outputs
+        self.queue.put(None)
+        self.t.join()
+        if self.writer is not None:
+            self.writer.release()
+        if self.raw_file is not None:
+            self.raw_file.close()
+        self.sidecar.close()
+        return self.stats()
+
+
+class Recording_Session:
+    """Records every synchronized frame set of the cameras for as long as it is running.
+
+    In "cameras" mode each camera gets its own Stream_Recorder fed from its capture thread. In
+    "grid" mode the composed grid from view_image is recorded once every camera has a new frame.
+    """
+
+    def __init__(
+        self,
+        frame_list,
+        directory="recordings/",
+        mode="cameras",
+        format="video",
+        codec="MJPG",
+        fps=None,
+        queue_size=32,
+        raw_chunk_frames=100,
+        grid_scale=0.5,
+    ):
+        self.frame_list = frame_list
+        self.mode = mode
+        self.grid_scale = grid_scale
+        self.directory = os.path.join(directory, time.strftime("recording_%Y%m%d_%H%M%S"))
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Record at the rate the cameras are triggered
+        if fps is None:
+            fps = frame_list[0].device.nodemap.get_node("PTPSyncFrameRate").value
+        self.fps = fps
+
+        recorder_args = dict(
+            fps=fps, format=format, codec=codec, queue_size=queue_size, raw_chunk_frames=raw_chunk_frames
+        )
+        self.recorders = {}
+        self.last_grid_frame_ids = None
+        if mode == "grid":
+            assert format != "stream", "Raw streams can only be recorded in cameras mode"
+            self.recorders["grid"] = Stream_Recorder(self.directory, "grid", **recorder_args)
+        else:
+            for frame in frame_list:
+                name = f"camera_{frame.which_camera}"
+                self.recorders[name] = Stream_Recorder(
+                    self.directory, name, metadata=self.camera_metadata(frame), **recorder_args
+                )
+                frame.add_frame_listener(self.on_frame)
+        self.start_time = time.time()
+        print(f"Recording {mode} at {fps} fps to {self.directory}")
+
+    # What a replay device needs to stand in for the camera
+    def camera_metadata(self, frame):
+        nodemap = frame.device.nodemap
+        mac_value = nodemap.get_node("GevMACAddress").value
+        return {
+            "which_camera": frame.which_camera,
+            "mac_address": ":".join(f"{(mac_value >> shift) & 0xFF:02X}" for shift in range(40, -8, -8)),
+            "serial_number": nodemap.get_node("DeviceSerialNumber").value,
+            "exposure": nodemap.get_node("ExposureTime").value,
+            "ptp_status": nodemap.get_node("PtpStatus").value,
+            "acquisition_geometry": list(frame.acquisition_geometry),
+        }
+
+    # Called from each camera's capture thread
+    def on_frame(self, npndarray, which_camera, frame_id, timestamp_ns):
+        self.recorders[f"camera_{which_camera}"].submit(npndarray, frame_id, timestamp_ns)
+
+    # Called from view_image with the composed grid and the (frame_id, timestamp_ns) of each camera's cell,
+    # only new frame sets are recorded
+    def submit_grid(self, combined_images, grid_frames):
+        if self.mode != "grid":
+            return
+        frame_ids = [grid_frames.get(frame.which_camera, (None, None))[0] for frame in self.frame_list]
+        if None in frame_ids:
+            return
+        # The cameras' frames of a trigger arrive one at a time; the set is complete once every camera
+        # moved on from the last recorded set (a lower id after a stream restart also counts) and all
+        # frames were exposed within half a trigger period of each other
+        if self.last_grid_frame_ids is not None and any(
+            frame_id == last_frame_id for frame_id, last_frame_id in zip(frame_ids, self.last_grid_frame_ids)
+        ):
+            return
+        timestamps = [grid_frames[frame.which_camera][1] for frame in self.frame_list]
+        if None not in timestamps and max(timestamps) - min(timestamps) > 0.5e9 / self.fps:
+            return
+        self.last_grid_frame_ids = frame_ids
+        if self.grid_scale != 1.0:
+            combined_images = cv2.resize(combined_images, (0, 0), fx=self.grid_scale, fy=self.grid_scale)
+        self.recorders["grid"].submit(combined_images, frame_ids, timestamps)
+
+    def stats(self):
+        return {name: recorder.stats() for name, recorder in self.recorders.items()}
+
+    def stop(self):
+        if self.mode != "grid":
+            for frame in self.frame_list:
+                frame.remove_frame_listener(self.on_frame)
+        duration = time.time() - self.start_time
+        stats = {name: recorder.close() for name, recorder in self.recorders.items()}
+        for name, stat in stats.items():
+            print(
+                f"Recorded {name}: {stat['frames_written']} frames in {duration:.1f} seconds, "
+                f"dropped {stat['frames_dropped']}, missed {stat['frames_missed']}, "
+                f"encoder lag mean {stat['mean_lag']:.3f} max {stat['max_lag']:.3f} seconds."
+            )
+        return stats
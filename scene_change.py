@@ -0,0 +1,68 @@
+import time
+import numpy as np
+
+
+class Scene_Change_Detector:
+    """Cheap per-camera check whether a new frame differs from the last processed one.
+
+    The signature of a frame is the mean of block x block cells of every step-th pixel, so only
+    1/step**2 of the frame is read. A frame counts as changed when the mean absolute difference of
+    its signature to the signature at the last refresh reaches threshold (in raw 8 bit levels),
+    or when refresh_interval seconds passed since that camera was last refreshed. Comparing with
+    the last refresh rather than the previous frame also catches slow drifts.
+
+    Signatures must be taken before preprocess_frame: its brightness boost saturates most of the
+    frame, which would hide changes. Frames that were already filtered by a detector on the raw
+    frames (sharded capture) are passed with prefiltered, then every new frame counts as changed.
+    """
+
+    def __init__(self, threshold=0.5, refresh_interval=5.0, step=8, block=8):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.step = step
+        self.block = block
+        # Per camera: (last frame object seen, signature at the last refresh, time of the last refresh)
+        self.last_frame = {}
+        self.reference = {}
+        self.refresh_time = {}
+        self.skipped = {}
+
+    def signature(self, npndarray):
+        sub = npndarray[:: self.step, :: self.step]
+        height = sub.shape[0] // self.block * self.block
+        width = sub.shape[1] // self.block * self.block
+        blocks = sub[:height, :width].reshape(height // self.block, self.block, width // self.block, self.block, -1)
+        return blocks.mean(axis=(1, 3, 4), dtype=np.float32)
+
+    def changed(self, which_camera, npndarray, now=None, prefiltered=False):
+        now = time.time() if now is None else now
+        reference = self.reference.get(which_camera)
+        refresh_due = now - self.refresh_time.get(which_camera, 0.0) >= self.refresh_interval
+
+        # The frame holder still holds the frame that was already looked at
+        if self.last_frame.get(which_camera) is npndarray and not refresh_due:
+            self.skipped[which_camera] = self.skipped.get(which_camera, 0) + 1
+            return False
+        self.last_frame[which_camera] = npndarray
+        if prefiltered:
+            self.refresh_time[which_camera] = now
+            return True
+
+        signature = self.signature(npndarray)
+        if (
+            reference is None
+            or refresh_due
+            or reference.shape != signature.shape
+            or np.abs(signature - reference).mean() >= self.threshold
+        ):
+            self.reference[which_camera] = signature
+            self.refresh_time[which_camera] = now
+            return True
+        self.skipped[which_camera] = self.skipped.get(which_camera, 0) + 1
+        return False
+
+    def reset(self):
+        self.last_frame.clear()
+        self.reference.clear()
+        self.refresh_time.clear()
+        self.skipped.clear()
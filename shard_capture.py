@@ -0,0 +1,372 @@
+import multiprocessing
+import threading
+import traceback
+import queue
+import time
+import sys
+import os
+from camera_setup import Camera_On, Camera_off, system
+from camera_watchdog import Camera_Watchdog
+from fake_device import create_fake_devices
+from frame_bus import Frame_Bus_Writer, Frame_Bus_Subscriber
+from undistort import crop_undistort_maps, preprocess_frame
+from scene_change import Scene_Change_Detector
+from utils import int_to_mac
+
+
+def split_shards(MAC_list, shards):
+    # Contiguous shards of (which_camera, mac_address), sizes differ by at most one camera
+    cameras = list(enumerate(MAC_list))
+    size, extra = divmod(len(cameras), shards)
+    result, start = [], 0
+    for shard_index in range(shards):
+        end = start + size + (1 if shard_index < extra else 0)
+        result.append(cameras[start:end])
+        start = end
+    return [shard for shard in result if shard]
+
+
+def create_shard_devices(mac_addresses):
+    # Only open the Arena devices of this shard, the other workers open the rest
+    device_infos = [info for info in system.device_infos if info["mac"].upper() in mac_addresses]
+    if len(device_infos) != len(mac_addresses):
+        found = [info["mac"].upper() for info in device_infos]
+        raise Exception(f"Devices not found: {[mac for mac in mac_addresses if mac not in found]}")
+    return system.create_device(device_infos=device_infos)
+
+
+def shard_worker(shard_index, shard, settings, commands, replies):
+    """Worker process owning the devices of one shard.
+
+    Each camera's capture thread preprocesses its frames (lighting, undistortion, crop) and writes
+    them to the shared memory frame bus, where the coordinator reads them. With an enabled
+    scene_change_config, frames whose raw scene did not change are neither preprocessed nor
+    published. Commands arrive on `commands`, every command is answered on `replies` tagged with
+    shard_index.
+    """
+    if settings.get("quiet", False):
+        sys.stdout = open(os.devnull, "w")
+    try:
+        mac_addresses = [mac_address for _, mac_address in shard]
+        if settings.get("simulate_devices", False):
+            devices = create_fake_devices(mac_addresses)
+        else:
+            devices = create_shard_devices(mac_addresses)
+
+        camera_index = {mac_address: which_camera for which_camera, mac_address in shard}
+        frame_list, writers, maps = [], {}, {}
+        frame_counts = {which_camera: 0 for which_camera, _ in shard}
+        frames_unchanged = {which_camera: 0 for which_camera, _ in shard}
+        scene_change_config = settings.get("scene_change_config") or {}
+        scene_detector = None
+        if scene_change_config.get("enabled", False):
+            scene_detector = Scene_Change_Detector(
+                threshold=scene_change_config.get("threshold", 0.5),
+                refresh_interval=scene_change_config.get("refresh_interval", 5.0),
+            )
+        process_times = {which_camera: 0.0 for which_camera, _ in shard}
+        x, y, w, h = settings["roi"]
+        binning = settings["acquisition"]["binning"]
+        for device in devices:
+            which_camera = camera_index[int_to_mac(device.nodemap.get_node("GevMACAddress").value)]
+            frame = Camera_On(
+                settings["Set_exposure"],
+                which_camera,
+                device,
+                settings.get("stream_stats_config"),
+                settings["acquisition"],
+            )
+            if settings.get("frame_rate") is not None:
+                device.nodemap.get_node("PTPSyncFrameRate").value = settings["frame_rate"]
+            maps[which_camera] = crop_undistort_maps(
+                settings["mapx"], settings["mapy"], settings["roi"], frame.acquisition_geometry
+            )
+            max_frame_bytes = (w // binning) * (h // binning) * frame.num_channels
+            writers[which_camera] = Frame_Bus_Writer(
+                settings["bus_name"], which_camera, max_frame_bytes, settings.get("slots", 4)
+            )
+            frame_list.append(frame)
+
+        # Runs in each camera's capture thread, so preprocessing is spread over this process' cameras
+        def on_frame(npndarray, which_camera, frame_id, timestamp_ns):
+            # Judged on the raw frame, the preprocessed one is mostly saturated
+            if scene_detector is not None and not scene_detector.changed(which_camera, npndarray):
+                frames_unchanged[which_camera] += 1
+                return
+            start_time = time.time()
+            dst = preprocess_frame(npndarray, *maps[which_camera])
+            writers[which_camera].write(dst, frame_id, timestamp_ns)
+            process_times[which_camera] += time.time() - start_time
+            frame_counts[which_camera] += 1
+
+        for frame in frame_list:
+            frame.add_frame_listener(on_frame)
+
+        def ptp_status():
+            return {frame.which_camera: frame.device.nodemap.get_node("PtpStatus").value for frame in frame_list}
+
+        replies.put(("ready", shard_index, ptp_status()))
+
+        watchdog = None
+        while True:
+            command = commands.get()
+            if command[0] == "ptp_status":
+                replies.put(("ptp_status", shard_index, ptp_status()))
+            elif command[0] == "start":
+                for frame in frame_list:
+                    frame.startProcess()
+                watchdog = Camera_Watchdog(frame_list, **settings.get("watchdog_config", {}))
+                watchdog.start()
+                replies.put(("started", shard_index, None))
+            elif command[0] == "health":
+                warnings = {frame.which_camera: frame.stream_stats.warnings() for frame in frame_list}
+                replies.put(("health", shard_index, warnings))
+            elif command[0] == "stream_stats":
+                summaries = {frame.which_camera: frame.stream_stats.summary() for frame in frame_list}
+                replies.put(("stream_stats", shard_index, summaries))
+            elif command[0] == "stats":
+                stats = {
+                    which_camera: {
+                        "frames": frame_counts[which_camera],
+                        "frames_unchanged": frames_unchanged[which_camera],
+                        "process_time": process_times[which_camera],
+                    }
+                    for which_camera in frame_counts
+                }
+                replies.put(("stats", shard_index, stats))
+            elif command[0] == "stop":
+                if watchdog is not None:
+                    watchdog.stop()
+                closing_threads = [threading.Thread(target=Camera_off, args=(frame,)) for frame in frame_list]
+                for thread in closing_threads:
+                    thread.start()
+                for thread in closing_threads:
+                    thread.join()
+                for writer in writers.values():
+                    writer.close()
+                if not settings.get("simulate_devices", False):
+                    system.destroy_device()
+                replies.put(("stopped", shard_index, None))
+                break
+    except Exception:
+        replies.put(("error", shard_index, traceback.format_exc()))
+
+
+class Shard_Frame:
+    """Stands in for the Video_Capture of a camera that runs in a shard worker process.
+
+    read() returns a copy of the latest preprocessed frame on the shared memory frame bus, or the
+    previous one if the shard overwrote the slot while it was being copied.
+    """
+
+    preprocessed = True
+
+    def __init__(self, which_camera, subscriber):
+        self.which_camera = which_camera
+        self.subscriber = subscriber
+        self.frame_holder = None
+        self.sequence = None
+        self.frame_id = None
+        self.frame_timestamp_ns = None
+
+    def read(self):
+        frame = self.subscriber.latest()
+        if frame is None:
+            return self.frame_holder
+        if frame.sequence == self.sequence:
+            return self.frame_holder
+        npndarray = frame.array.copy()
+        if not frame.valid():
+            return self.frame_holder
+        self.frame_holder = (npndarray, self.which_camera, frame.frame_id, frame.timestamp_ns)
+        self.sequence = frame.sequence
+        self.frame_id = frame.frame_id
+        self.frame_timestamp_ns = frame.timestamp_ns
+        return self.frame_holder
+
+
+class Shard_Coordinator:
+    """Splits the cameras of MAC_list over `shards` worker processes and coordinates them.
+
+    settings are passed to every shard_worker: Set_exposure, acquisition, the calibration maps
+    (mapx, mapy, roi), simulate_devices, bus_name, slots, stream_stats_config, watchdog_config and
+    optionally scene_change_config, frame_rate and quiet. frame_list holds a Shard_Frame per camera in MAC_list order.
+    """
+
+    def __init__(self, MAC_list, shards, settings, timeout=120.0):
+        start_time = time.time()
+        self.timeout = timeout
+        # Replies of concurrent broadcasts would be taken by the wrong collect
+        self.lock = threading.RLock()
+        self.closed = False
+        # Spawn on every platform, so workers never inherit device handles of this process
+        context = multiprocessing.get_context("spawn")
+        self.replies = context.Queue()
+        self.shards = split_shards(MAC_list, shards)
+        self.commands = []
+        self.processes = []
+        for shard_index, shard in enumerate(self.shards):
+            commands = context.Queue()
+            process = context.Process(
+                target=shard_worker, args=(shard_index, shard, settings, commands, self.replies), daemon=True
+            )
+            process.start()
+            self.commands.append(commands)
+            self.processes.append(process)
+
+        self.ptp_status = {}
+        for _, ptp_status in self.collect("ready"):
+            self.ptp_status.update(ptp_status)
+
+        self.frame_list = [None] * len(MAC_list)
+        for shard in self.shards:
+            for which_camera, _ in shard:
+                subscriber = Frame_Bus_Subscriber(settings["bus_name"], which_camera)
+                self.frame_list[which_camera] = Shard_Frame(which_camera, subscriber)
+        end_time = time.time()
+        print(f"Starting {len(self.shards)} shard(s) took {end_time - start_time} seconds.")
+
+    def collect(self, kind, timeout=None):
+        # One reply of `kind` from every shard, in shard order
+        timeout = self.timeout if timeout is None else timeout
+        results = {}
+        deadline = time.time() + timeout
+        while len(results) < len(self.shards):
+            try:
+                reply, shard_index, payload = self.replies.get(timeout=min(max(deadline - time.time(), 0.01), 1.0))
+            except queue.Empty:
+                dead = [i for i, process in enumerate(self.processes) if i not in results and not process.is_alive()]
+                if dead:
+                    raise Exception(f"Shard(s) {dead} exited without answering {kind}")
+                if time.time() < deadline:
+                    continue
+                raise Exception(f"Shards did not answer {kind} within {timeout} seconds")
+            if reply == "error":
+                raise Exception(f"Shard {shard_index} failed:\n{payload}")
+            if reply == kind:
+                results[shard_index] = payload
+        return [(shard_index, results[shard_index]) for shard_index in sorted(results)]
+
+    def broadcast(self, command, reply, timeout=None):
+        with self.lock:
+            for commands in self.commands:
+                commands.put(command)
+            return self.collect(reply, timeout)
+
+    def wait_for_ptp(self):
+        # Same rule as a single process: exactly one Master, all other cameras Slave
+        i = 0
+        while True:
+            ptp_status = {}
+            for _, status in self.broadcast(("ptp_status",), "ptp_status"):
+                ptp_status.update(status)
+            statuses = list(ptp_status.values())
+            if statuses.count("Master") == 1 and statuses.count("Slave") == len(statuses) - 1:
+                break
+            time.sleep(1)
+            i += 1
+            print(f"Trying {i}th Negotiate. MasterFound: {'Master' in statuses}.")
+        self.ptp_status = ptp_status
+
+    def start(self):
+        self.broadcast(("start",), "started")
+
+    def gather(self, command, timeout=None):
+        # Per camera answers of all shards to `command` merged by camera index, nothing once closed
+        result = {}
+        with self.lock:
+            if self.closed:
+                return result
+            for _, answers in self.broadcast((command,), command, timeout):
+                result.update(answers)
+        return result
+
+    def health(self, timeout=5.0):
+        # Stream health warnings of every camera, keyed by camera index
+        return self.gather("health", timeout)
+
+    def stream_stats(self, timeout=5.0):
+        # Stream_Stats.summary() of every camera, keyed by camera index
+        return self.gather("stream_stats", timeout)
+
+    def stats(self):
+        result = {}
+        for _, stats in self.broadcast(("stats",), "stats"):
+            result.update(stats)
+        return result
+
+    def close(self, timeout=30.0):
+        with self.lock:
+            self.closed = True
+            try:
+                self.broadcast(("stop",), "stopped", timeout)
+            except Exception as e:
+                # A worker died or hangs, the others may have stopped already
+                print(f"Shards did not stop cleanly: {e}")
+        for frame in self.frame_list:
+            if frame is not None:
+                frame.subscriber.close()
+        for process in self.processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+# Scaling with simulated devices: python shard_capture.py --cameras 4 8 16 --shards 1 2 4
+if __name__ == "__main__":
+    import argparse
+    import json
+    import numpy as np
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Measure sharded capture throughput with simulated devices.")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--fps", type=float, default=5.0, help="PTPSyncFrameRate of the simulated cameras")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open("calibration_data.json", "r") as json_file:
+        calibration_data = json.load(json_file)
+    mtx = np.array(calibration_data["camera_matrix"])
+    dist = np.array(calibration_data["distortion_coefficients"])
+    w = calibration_data["image_width"]
+    h = calibration_data["image_height"]
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
+    mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, (w, h), 5)
+
+    print(f"{os.cpu_count()} CPU(s), {args.fps} fps per camera, {args.seconds} seconds per run")
+    print("cameras shards  frames/s  target  per camera  process ms/frame")
+    for cameras in args.cameras:
+        MAC_list = [int_to_mac(0x1C0FAF000000 + index) for index in range(cameras)]
+        for shards in args.shards:
+            if shards > cameras:
+                continue
+            settings = {
+                "Set_exposure": 2000.0,
+                "acquisition": {"sensor_roi": None, "binning": 1, "binning_mode": "binning"},
+                "mapx": mapx,
+                "mapy": mapy,
+                "roi": roi,
+                "simulate_devices": True,
+                "bus_name": "ag_cameras_bench",
+                "frame_rate": args.fps,
+                "watchdog_config": {"frame_timeout": 60.0, "check_ptp": False},
+                "quiet": True,
+            }
+            coordinator = Shard_Coordinator(MAC_list, shards, settings)
+            coordinator.start()
+            time.sleep(1.0)
+            before = coordinator.stats()
+            time.sleep(args.seconds)
+            after = coordinator.stats()
+            coordinator.close()
+
+            frames = sum(after[i]["frames"] - before[i]["frames"] for i in after)
+            process_time = sum(after[i]["process_time"] - before[i]["process_time"] for i in after)
+            rate = frames / args.seconds
+            print(
+                f"{cameras:7d} {shards:6d} {rate:9.1f} {cameras * args.fps:7.1f} {rate / cameras:11.2f} "
+                f"{1000 * process_time / max(frames, 1):17.1f}"
+            )
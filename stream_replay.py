@@ -0,0 +1,250 @@
+import threading
+import struct
+import time
+import json
+import os
+import glob
+import numpy as np
+from fake_device import Fake_Node, Fake_Nodemap, Fake_Buffer
+
+
+# Raw stream file: magic, uint32 length of a json header, then one record per frame
+STREAM_MAGIC = b"AGSTREAM"
+# frame_id, timestamp_ns, host_time, height, width, channels, followed by the uint8 pixels
+STREAM_RECORD = struct.Struct("<qqdIII")
+STREAM_EXTENSION = ".stream"
+
+
+def write_stream_header(stream_file, metadata):
+    header = json.dumps(metadata).encode("utf-8")
+    stream_file.write(STREAM_MAGIC)
+    stream_file.write(struct.pack("<I", len(header)))
+    stream_file.write(header)
+
+
+def write_stream_record(stream_file, frame, frame_id, timestamp_ns, host_time):
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    stream_file.write(STREAM_RECORD.pack(frame_id, timestamp_ns, host_time, height, width, channels))
+    stream_file.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+
+
+class Stream_Reader:
+    """Index of the frames in a raw stream file, frames are read on demand or all preloaded."""
+
+    def __init__(self, path, preload=False):
+        self.path = path
+        self.stream_file = open(path, "rb")
+        if self.stream_file.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+            raise ValueError(f"{path} is not a raw stream file")
+        (header_length,) = struct.unpack("<I", self.stream_file.read(4))
+        self.metadata = json.loads(self.stream_file.read(header_length).decode("utf-8"))
+
+        # (offset of the pixels, frame_id, timestamp_ns, host_time, shape)
+        self.records = []
+        while True:
+            record = self.stream_file.read(STREAM_RECORD.size)
+            if len(record) < STREAM_RECORD.size:
+                break
+            frame_id, timestamp_ns, host_time, height, width, channels = STREAM_RECORD.unpack(record)
+            offset = self.stream_file.tell()
+            size = height * width * channels
+            # A truncated last frame (recording interrupted) is left out
+            if offset + size > os.fstat(self.stream_file.fileno()).st_size:
+                break
+            self.records.append((offset, frame_id, timestamp_ns, host_time, (height, width, channels)))
+            self.stream_file.seek(size, os.SEEK_CUR)
+
+        self.frames = None
+        if preload:
+            self.frames = [np.array(self.read_frame(index)) for index in range(len(self.records))]
+
+    def __len__(self):
+        return len(self.records)
+
+    def read_frame(self, index):
+        if self.frames is not None:
+            return self.frames[index]
+        offset, _, _, _, shape = self.records[index]
+        self.stream_file.seek(offset)
+        data = self.stream_file.read(shape[0] * shape[1] * shape[2])
+        return np.frombuffer(data, dtype=np.uint8).reshape(shape)
+
+    def close(self):
+        self.stream_file.close()
+
+
+class Fixed_Node(Fake_Node):
+    # Recorded geometry can not be changed by Video_Capture.setup
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if not hasattr(self, "_value"):
+            self._value = value
+
+
+class Replay_Device:
+    """Device that plays a recorded raw stream back through Video_Capture like a live camera.
+
+    timing is "recorded" to deliver frames at their recorded device timestamps, or "fast" to
+    deliver them as fast as the consumer takes them. With loop the stream starts over at the end,
+    otherwise get_buffer raises EOFError and the device reports finished. Frame ids are the
+    recorded ones.
+    """
+
+    def __init__(self, path, timing="recorded", loop=True, preload=False):
+        self.reader = Stream_Reader(path, preload)
+        if not len(self.reader):
+            raise ValueError(f"{path} contains no frames")
+        self.timing = timing
+        self.loop = loop
+        metadata = self.reader.metadata
+
+        offset_x, offset_y, width, height, binning, binning_mode = metadata["acquisition_geometry"]
+        self.nodemap = Fake_Nodemap(
+            {
+                "DeviceSerialNumber": metadata.get("serial_number", "REPLAY"),
+                "GevMACAddress": int(metadata["mac_address"].replace(":", ""), 16),
+                "ExposureAuto": "Off",
+                "ExposureTime": metadata.get("exposure", 0.0),
+                "PtpEnable": True,
+                "PtpSlaveOnly": False,
+                "PtpStatus": metadata.get("ptp_status", "Slave"),
+                "PixelFormat": "BGR8",
+                "GevSCPD": 0,
+                "GevSCFTD": 0,
+                "AcquisitionStartMode": "PTPSync",
+                "PTPSyncFrameRate": metadata.get("fps", 1.0),
+            }
+        )
+        # Geometry nodes in binned pixels, fixed to what was recorded
+        geometry = {
+            "OffsetX": offset_x // binning,
+            "OffsetY": offset_y // binning,
+            "Width": width // binning,
+            "Height": height // binning,
+            "BinningHorizontal": binning if binning_mode == "binning" else 1,
+            "BinningVertical": binning if binning_mode == "binning" else 1,
+            "DecimationHorizontal": binning if binning_mode == "decimation" else 1,
+            "DecimationVertical": binning if binning_mode == "decimation" else 1,
+        }
+        for node, value in geometry.items():
+            self.nodemap.nodes[node] = Fixed_Node(value, value, value, 1)
+
+        self.tl_stream_nodemap = Fake_Nodemap(
+            {
+                "StreamAutoNegotiatePacketSize": True,
+                "StreamPacketResendEnable": True,
+                "StreamBufferHandlingMode": "OldestFirst",
+            }
+        )
+        self.streaming = threading.Event()
+        self.position = 0
+        self.start_time = None
+        self.first_timestamp_ns = None
+        self.frames_replayed = 0
+
+    def start_stream(self, *args):
+        self.start_time = None
+        self.streaming.set()
+
+    def stop_stream(self):
+        if not self.streaming.is_set():
+            raise RuntimeError("Stream is not started")
+        self.streaming.clear()
+
+    def get_buffer(self, timeout=None):
+        if not self.streaming.is_set():
+            raise RuntimeError("Stream is not started")
+        if self.position >= len(self.reader):
+            if not self.loop:
+                # End of the recording: end the capture thread instead of blocking it, so the stream
+                # can still be stopped, and the watchdog skips finished devices
+                raise EOFError("End of the recording")
+            self.position = 0
+            self.start_time = None
+
+        _, frame_id, timestamp_ns, _, _ = self.reader.records[self.position]
+        if self.timing == "recorded":
+            # Deliver the frame at its recorded offset from the first frame after (re)start
+            if self.start_time is None:
+                self.start_time = time.time()
+                self.first_timestamp_ns = timestamp_ns
+            delay = self.start_time + (timestamp_ns - self.first_timestamp_ns) / 1e9 - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        array = self.reader.read_frame(self.position)
+        self.position += 1
+        self.frames_replayed += 1
+        return Fake_Buffer(array, frame_id, timestamp_ns)
+
+    @property
+    def finished(self):
+        # All frames were delivered and the recording does not loop; the watchdog leaves it alone
+        return not self.loop and self.position >= len(self.reader)
+
+    def copy_buffer(self, buffer):
+        return np.array(buffer.array)
+
+    def requeue_buffer(self, buffer):
+        pass
+
+
+def create_replay_devices(directory, timing="recorded", loop=True, preload=False):
+    # One replay device per camera_<i>.stream of a recording directory
+    paths = sorted(glob.glob(os.path.join(directory, f"camera_*{STREAM_EXTENSION}")))
+    if not paths:
+        raise Exception(f"No {STREAM_EXTENSION} files found in {directory}")
+    devices = [Replay_Device(path, timing, loop, preload) for path in paths]
+    print(f"Created {len(devices)} replay device(s) from {directory}")
+    return devices
+
+
+# Replays a recording through Video_Capture and reports throughput and frame intervals
+if __name__ == "__main__":
+    import argparse
+    from camera_setup import Camera_On, Camera_off
+
+    parser = argparse.ArgumentParser(description="Replay a raw stream recording through Video_Capture.")
+    parser.add_argument("directory", help="Recording directory containing camera_<i>.stream files")
+    parser.add_argument("--timing", choices=["recorded", "fast"], default="fast")
+    parser.add_argument("--frames", type=int, default=None, help="Frames per camera, default one pass")
+    parser.add_argument("--preload", action="store_true", help="Read all frames into memory first")
+    args = parser.parse_args()
+
+    devices = create_replay_devices(args.directory, args.timing, loop=True, preload=args.preload)
+    frames_per_camera = args.frames or min(len(device.reader) for device in devices)
+
+    frame_list = []
+    arrivals = [[] for _ in devices]
+    for index, device in enumerate(devices):
+        frame = Camera_On(device.nodemap["ExposureTime"].value, index, device)
+        # Arrival time of every frame in the frame holder
+        frame.add_frame_listener(
+            lambda npndarray, which_camera, frame_id, timestamp_ns: arrivals[which_camera].append(time.time())
+        )
+        frame_list.append(frame)
+
+    start_time = time.time()
+    for frame in frame_list:
+        frame.startProcess()
+    while any(len(times) < frames_per_camera for times in arrivals):
+        time.sleep(0.01)
+    duration = time.time() - start_time
+    for frame in frame_list:
+        Camera_off(frame)
+
+    total_frames = sum(min(len(times), frames_per_camera) for times in arrivals)
+    print(f"Replayed {total_frames} frames from {len(devices)} camera(s) in {duration:.3f} seconds.")
+    print(f"Throughput: {total_frames / duration:.1f} frames/s")
+    for index, times in enumerate(arrivals):
+        intervals = np.diff(times[:frames_per_camera])
+        if len(intervals):
+            print(
+                f"Camera_{index} frame interval mean {intervals.mean() * 1000:.2f} ms, "
+                f"p99 {np.percentile(intervals, 99) * 1000:.2f} ms"
+            )
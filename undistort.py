@@ -0,0 +1,30 @@
+import numpy as np
+import cv2
+
+
+def crop_undistort_maps(mapx, mapy, roi, acquisition_geometry):
+    """Undistortion maps from a camera's actual sensor ROI and binning straight to the cropped cell.
+
+    mapx/mapy are the full frame maps of the calibration and roi its (x, y, w, h) crop.
+    acquisition_geometry is (offset_x, offset_y, width, height, binning, binning_mode) as read back
+    from the camera, offsets in full resolution sensor pixels. The maps only cover the crop, so
+    remap produces the cell directly without undistorting the discarded border.
+    """
+    x, y, w, h = roi
+    offset_x, offset_y, _, _, binning, binning_mode = acquisition_geometry
+    cell_w, cell_h = w // binning, h // binning
+    # Full resolution sensor coordinates of every output pixel of the (binned) crop
+    roi_mapx = mapx[y : y + h : binning, x : x + w : binning][:cell_h, :cell_w]
+    roi_mapy = mapy[y : y + h : binning, x : x + w : binning][:cell_h, :cell_w]
+    # A binned pixel sits at the centre of the sensor pixels it combines, a decimated one does not
+    center = (binning - 1) / 2 if binning_mode == "binning" else 0
+    return (
+        ((roi_mapx - offset_x - center) / binning).astype(np.float32),
+        ((roi_mapy - offset_y - center) / binning).astype(np.float32),
+    )
+
+
+def preprocess_frame(npndarray, crop_mapx, crop_mapy):
+    # Lighting adjustment, undistortion, and cropping (the maps only cover the crop)
+    npndarray = cv2.convertScaleAbs(npndarray, alpha=10, beta=60)
+    return cv2.remap(npndarray, crop_mapx, crop_mapy, cv2.INTER_LINEAR)
@@ -14,3 +14,20 @@ def is_digit(app, button, string, original_text, original_color):
         return False
 
     return True
+
+
+# Function to convert an integer to a MAC address string
+def int_to_mac(mac_value):
+    try:
+        mac_bytes = [
+            (mac_value >> 40) & 0xFF,
+            (mac_value >> 32) & 0xFF,
+            (mac_value >> 24) & 0xFF,
+            (mac_value >> 16) & 0xFF,
+            (mac_value >> 8) & 0xFF,
+            mac_value & 0xFF,
+        ]
+        mac_address = ":".join(f"{byte:02X}" for byte in mac_bytes)
+        return mac_address
+    except Exception as e:
+        return f"Error converting MAC address: {e}"